@@ -0,0 +1,49 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from run import DIR, install_fake, spawns
+
+DAEMON = os.path.join(DIR, "daemon.py")
+CLIENTS = int(os.environ.get("BENCHMARK_CLIENTS", 5))
+IDLE_SECONDS = float(os.environ.get("BENCHMARK_IDLE_SECONDS", 20))
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix="expressvpn-bench-")
+    env = install_fake(directory)
+    env["EXPRESSVPN_GUI_SOCKET"] = os.path.join(directory, "daemon.sock")
+    env["EXPRESSVPN_GUI_PROBE_MODE"] = "passive"
+    server = subprocess.Popen([sys.executable, DAEMON], env=env)
+    clients = []
+    try:
+        time.sleep(1)
+        clients = [
+            subprocess.Popen(
+                [sys.executable, DAEMON, "subscribe"],
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+            for _ in range(CLIENTS)
+        ]
+        time.sleep(2)
+        before = spawns(env)
+        time.sleep(IDLE_SECONDS)
+        idle_spawns = spawns(env) - before
+    finally:
+        for process in clients + [server]:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory)
+
+    print(f"{'clients':<32} {CLIENTS:12d}")
+    print(f"{'idle_spawns_per_minute':<32} {idle_spawns / IDLE_SECONDS * 60:12.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
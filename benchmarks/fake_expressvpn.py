@@ -0,0 +1,154 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+STATE = os.environ.get(
+    "FAKE_EXPRESSVPN_STATE", os.path.join(tempfile.gettempdir(), "fake_expressvpn.json")
+)
+LOG = os.environ.get("FAKE_EXPRESSVPN_LOG")
+LATENCY = float(os.environ.get("FAKE_EXPRESSVPN_LATENCY", 0))
+CONNECT_LATENCY = float(os.environ.get("FAKE_EXPRESSVPN_CONNECT_LATENCY", 0.5))
+FAILURE_RATE = float(os.environ.get("FAKE_EXPRESSVPN_FAILURE_RATE", 0))
+FAIL = set(filter(None, os.environ.get("FAKE_EXPRESSVPN_FAIL", "").split(",")))
+LOCATIONS = int(os.environ.get("FAKE_EXPRESSVPN_LOCATIONS", 150))
+VERSION = os.environ.get("FAKE_EXPRESSVPN_VERSION", "3.52.0.2")
+PROTOCOLS = ["auto", "udp", "tcp", "lightway_udp", "lightway_tcp"]
+DEFAULT_STATE = {
+    "daemon": True,
+    "activated": True,
+    "location": None,
+    "preferences": {
+        "auto_connect": "false",
+        "preferred_protocol": "auto",
+        "desktop_notifications": "true",
+        "network_lock": "default",
+    },
+}
+
+
+def locations():
+    for index in range(LOCATIONS):
+        group = index // 5
+        country = f"Country {group} (C{group})" if index % 5 == 0 else ""
+        yield f"loc{index}", country, f"Country {group} - City {index}", index % 3 == 0
+
+
+def location_name(key):
+    if key == "smart":
+        return next(locations())[2]
+    for alias, _, name, _ in locations():
+        if alias == key:
+            return name
+
+    return None
+
+
+def load_state():
+    try:
+        with open(STATE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return json.loads(json.dumps(DEFAULT_STATE))
+
+
+def save_state(state):
+    temp_file = f"{STATE}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_file, STATE)
+
+
+def log(args):
+    if not LOG:
+        return
+
+    with open(LOG, "a") as f:
+        f.write(f"{time.time():.6f} {' '.join(args)}\n")
+
+
+def fail(message, code=1):
+    print(message, file=sys.stderr)
+    sys.exit(code)
+
+
+def status(state):
+    if not state["activated"]:
+        print("Not Activated. Please run 'expressvpn activate' to activate an account.")
+    elif state["location"]:
+        print(f"\x1b[1;32;49mConnected to {state['location']}\x1b[0m")
+        print()
+        print("   - To check your connection status, type 'expressvpn status'.")
+    else:
+        print("Not connected")
+
+
+def list_all():
+    print(
+        "ALIAS COUNTRY                     LOCATION                       RECOMMENDED"
+    )
+    print(
+        "----- ---------------             ------------------------------ -----------"
+    )
+    first = next(locations())
+    print(f"{'smart':<5} {'Smart Location':<27} {first[2]:<30} Y")
+    for alias, country, name, recommended in locations():
+        print(f"{alias:<5} {country:<27} {name:<30} {'Y' if recommended else ''}")
+
+
+def main(args):
+    log(args)
+    time.sleep(LATENCY)
+    command = args[0] if args else ""
+    if command in FAIL or random.random() < FAILURE_RATE:
+        fail(f"fake failure: {command}")
+
+    state = load_state()
+    if command == "-v":
+        print(f"expressvpn version {VERSION}")
+        return
+    if not state["daemon"]:
+        fail("Cannot connect to expressvpnd daemon.")
+
+    if command == "status":
+        status(state)
+    elif args[:2] == ["list", "all"]:
+        list_all()
+    elif args == ["preferences"]:
+        for key, value in state["preferences"].items():
+            print(f"{key}\t{value}")
+    elif args[:2] == ["preferences", "set"] and len(args) == 4:
+        state["preferences"][args[2]] = args[3]
+        save_state(state)
+    elif args == ["protocol", "--list"]:
+        print("\n".join(PROTOCOLS))
+    elif command == "protocol" and len(args) == 2:
+        if args[1] not in PROTOCOLS:
+            fail(f"Unknown protocol {args[1]}")
+        state["preferences"]["preferred_protocol"] = args[1]
+        save_state(state)
+    elif command == "connect":
+        name = location_name(args[1] if len(args) > 1 else "smart")
+        if name is None:
+            fail("Unknown location")
+        time.sleep(CONNECT_LATENCY)
+        state = load_state()
+        state["location"] = name
+        save_state(state)
+        print(f"Connected to {name}")
+    elif command == "disconnect":
+        state["location"] = None
+        save_state(state)
+        print("Disconnected.")
+    elif command == "activate":
+        input("Enter activation code: ")
+        state["activated"] = True
+        save_state(state)
+    else:
+        fail(f"Unknown command: {' '.join(args)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+import glob
+import json
+import os
+import sys
+import timeit
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(DIR, "benchmarks", "corpus")
+sys.path.insert(0, DIR)
+
+from parsers import (  # noqa: E402
+    parse_locations,
+    parse_preferences,
+    parse_protocols,
+    parse_status,
+    parse_version,
+)
+
+PARSERS = {
+    "list": parse_locations,
+    "preferences": parse_preferences,
+    "protocols": parse_protocols,
+    "status": parse_status,
+    "version": parse_version,
+}
+NUMBER = int(os.environ.get("BENCHMARK_NUMBER", 2000))
+
+
+def _serialize(result):
+    if isinstance(result, list):
+        return [_serialize(item) for item in result]
+    if hasattr(result, "_asdict"):
+        return result._asdict()
+
+    return result
+
+
+def _synthetic_list(size):
+    lines = ["ALIAS COUNTRY            LOCATION                 RECOMMENDED"]
+    lines.append("----- ---------------    ------------------------ -----------")
+    lines.append("smart Smart Location     Country 0 - City 0       Y")
+    for index in range(size):
+        country = f"Country {index // 10} (C{index // 10})" if index % 10 == 0 else ""
+        lines.append(
+            f"loc{index:<4} {country:<24} Country {index // 10} - City {index:<8} Y"
+        )
+
+    return "\n".join(lines)
+
+
+def corpus():
+    for path in sorted(glob.glob(os.path.join(CORPUS, "*.txt"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "r") as f:
+            yield name, PARSERS[name.split("_")[0]], f.read()
+
+
+def check(update=False):
+    failures = 0
+
+    for name, parser, output in corpus():
+        golden = os.path.join(CORPUS, f"{name}.json")
+        result = _serialize(parser(output))
+        if update:
+            with open(golden, "w") as f:
+                json.dump(result, f, indent=2)
+                f.write("\n")
+            continue
+        with open(golden, "r") as f:
+            expected = json.load(f)
+        if result != expected:
+            failures += 1
+            print(f"MISMATCH {name}")
+            print(f"  expected {expected}")
+            print(f"  got      {result}")
+
+    return failures
+
+
+def benchmark():
+    cases = list(corpus())
+    cases.append(("list_synthetic_1000", parse_locations, _synthetic_list(1000)))
+
+    for name, parser, output in cases:
+        number = NUMBER if len(output) < 10000 else max(NUMBER // 100, 1)
+        elapsed = timeit.timeit(lambda: parser(output), number=number)
+        print(f"{name:<36} {elapsed / number * 1e6:10.1f} us/parse")
+
+
+def main():
+    if "--update" in sys.argv:
+        check(update=True)
+        return 0
+
+    failures = check()
+    if failures:
+        print(f"{failures} golden file(s) differ")
+        return 1
+    benchmark()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
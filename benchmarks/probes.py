@@ -0,0 +1,94 @@
+import os
+import socket
+import sys
+import time
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR)
+
+from network import LatencyRanker, Reachability  # noqa: E402
+from parsers import Location, StatusSnapshot  # noqa: E402
+
+TIMEOUT = 0.5
+
+
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+
+    return server, server.getsockname()
+
+
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    address = sock.getsockname()
+    sock.close()
+
+    return address
+
+
+def check_reachability(up, down):
+    results = {}
+    reachable = Reachability(targets=[down, up], timeout=TIMEOUT, passive=False)
+    started = time.monotonic()
+    results["reachable"] = reachable.check() is True
+    results["probe_seconds"] = time.monotonic() - started
+    unreachable = Reachability(targets=[down], timeout=TIMEOUT, passive=False)
+    results["unreachable"] = unreachable.check() is False
+    # A cached result is served until invalidated
+    unreachable.targets = [up]
+    results["cached"] = unreachable.check() is False
+    unreachable.invalidate()
+    results["invalidated"] = unreachable.check() is True
+
+    passive = Reachability(targets=[up], passive=True)
+    offline = StatusSnapshot(True, True, False, None, "Network is unreachable")
+    online = StatusSnapshot(True, True, False, None, "Not connected")
+    results["passive_offline"] = passive.check(offline) is False
+    results["passive_online"] = passive.check(online) is True
+
+    return results
+
+
+def check_latency(up, down):
+    locations = [
+        Location("up", "Up", "Local", True),
+        Location("down", "Down", "Local", True),
+        Location("smart", "Smart Location", None, True),
+    ]
+    targets = {"up": up, "down": down}
+    ranker = LatencyRanker(
+        target=lambda location: targets[location.key], timeout=TIMEOUT
+    )
+    ranking = ranker.measure(locations)
+
+    return {
+        "ranked": [name for name, _ in ranking] == ["Up"],
+        "fastest": ranker.fastest(locations) == "Up",
+        "fresh": not ranker.is_stale(locations),
+    }
+
+
+def main():
+    server, up = listener()
+    down = closed_port()
+    try:
+        results = dict(check_reachability(up, down), **check_latency(up, down))
+    finally:
+        server.close()
+
+    failed = False
+    for name, value in results.items():
+        if isinstance(value, bool):
+            failed = failed or not value
+            print(f"{name:<32} {'ok' if value else 'FAIL':>12}")
+        else:
+            print(f"{name:<32} {value:12.4f}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import json
+import os
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(DIR, "expressvpn.py")
+FAKE = os.path.join(DIR, "benchmarks", "fake_expressvpn.py")
+IDLE_SECONDS = float(os.environ.get("BENCHMARK_IDLE_SECONDS", 30))
+CORE_TICKS = int(os.environ.get("BENCHMARK_CORE_TICKS", 50))
+EVENT_TIMEOUT = 30
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+SETTLE_SECONDS = 3
+sys.path.insert(0, DIR)
+
+
+def install_fake(directory, **options):
+    binary = os.path.join(directory, "expressvpn")
+    with open(binary, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE}" "$@"\n')
+    os.chmod(binary, 0o755)
+
+    env = dict(
+        os.environ,
+        PATH=f"{directory}{os.pathsep}{os.environ.get('PATH', '')}",
+        FAKE_EXPRESSVPN_STATE=os.path.join(directory, "state.json"),
+        FAKE_EXPRESSVPN_LOG=os.path.join(directory, "calls.log"),
+        EXPRESSVPN_GUI_DATA_DIR=directory,
+        EXPRESSVPN_GUI_SOCKET=os.path.join(directory, "daemon.sock"),
+    )
+    env.update({f"FAKE_EXPRESSVPN_{k.upper()}": str(v) for k, v in options.items()})
+
+    return env
+
+
+def spawns(env):
+    try:
+        with open(env["FAKE_EXPRESSVPN_LOG"], "r") as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+
+    return sum(int(value) for value in fields[11:15]) / CLOCK_TICKS
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+    return 0
+
+
+def core_benchmark(env):
+    os.environ.update(env)
+    from utils import executor, get_preferences_dict, get_status
+
+    get_status()
+    before_spawns = spawns(env)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.monotonic()
+    for _ in range(CORE_TICKS):
+        # Real ticks are further apart than the read cache window
+        executor.invalidate()
+        get_status()
+        get_preferences_dict()
+    elapsed = time.monotonic() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+    return {
+        "core_spawns_per_tick": (spawns(env) - before_spawns) / CORE_TICKS,
+        "core_tick_ms": elapsed / CORE_TICKS * 1000,
+        "core_cpu_ms_per_tick": cpu / CORE_TICKS * 1000,
+    }
+
+
+class App:
+    def __init__(self, env, args=(), **options):
+        env = dict(env, EXPRESSVPN_GUI_BENCHMARK="1")
+        env.update(
+            {f"EXPRESSVPN_GUI_BENCHMARK_{k.upper()}": v for k, v in options.items()}
+        )
+        self.events = queue.Queue()
+        self.started = time.monotonic()
+        self.process = subprocess.Popen(
+            [sys.executable, APP, *args], stdout=subprocess.PIPE, env=env, text=True
+        )
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            event["wall"] = time.monotonic() - self.started
+            self.events.put(event)
+
+    def wait(self, name, timeout=EVENT_TIMEOUT, **match):
+        deadline = time.monotonic() + timeout
+        seen = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"timed out waiting for {name!r} event")
+            try:
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            seen.append(event)
+            if event["event"] == name and all(
+                event.get(k) == v for k, v in match.items()
+            ):
+                return event, seen
+
+    def drain(self):
+        events = []
+        while not self.events.empty():
+            events.append(self.events.get())
+
+        return events
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def app_benchmark(env):
+    results = {}
+    app = App(env)
+    try:
+        results["time_to_tray_ms"] = app.wait("tray")[0]["wall"] * 1000
+        results["time_to_window_ms"] = app.wait("window")[0]["wall"] * 1000
+        time.sleep(SETTLE_SECONDS)
+        results["rss_mb"] = rss_mb(app.process.pid)
+        time.sleep(min(IDLE_SECONDS / 3, 5))
+        # No stall watchdog here, its timer and thread would be in the sample
+        events = app.drain()
+        cpu_before = cpu_seconds(app.process.pid)
+        spawns_before = spawns(env)
+        time.sleep(IDLE_SECONDS)
+        cpu_after = cpu_seconds(app.process.pid)
+        events += app.drain()
+        ticks = sum(1 for event in events if event["event"] == "tick")
+        idle_spawns = spawns(env) - spawns_before
+        results["idle_ticks_per_minute"] = ticks / IDLE_SECONDS * 60
+        results["idle_spawns_per_minute"] = idle_spawns / IDLE_SECONDS * 60
+        results["spawns_per_tick"] = idle_spawns / ticks if ticks else 0
+        results["idle_cpu_seconds_per_hour"] = (
+            (cpu_after - cpu_before) / IDLE_SECONDS * 3600
+        )
+    finally:
+        app.stop()
+
+    app = App(env, stalls="1")
+    try:
+        _, events = app.wait("window")
+        time.sleep(SETTLE_SECONDS + min(IDLE_SECONDS / 3, 5))
+        events += app.drain()
+        stalls = [event["duration"] for event in events if event["event"] == "stall"]
+        results["stalls"] = len(stalls)
+        results["max_stall_ms"] = max(stalls, default=0) * 1000
+    finally:
+        app.stop()
+
+    app = App(env, args=["--tray-only"])
+    try:
+        results["tray_only_time_to_tray_ms"] = app.wait("tray")[0]["wall"] * 1000
+        time.sleep(SETTLE_SECONDS)
+        results["tray_only_rss_mb"] = rss_mb(app.process.pid)
+    finally:
+        app.stop()
+
+    launch_env = install_fake(tempfile.mkdtemp(prefix="expressvpn-bench-"))
+    launch_env["EXPRESSVPN_GUI_CONNECT_ON_LAUNCH"] = "1"
+    settings = os.path.join(launch_env["EXPRESSVPN_GUI_DATA_DIR"], "settings.json")
+    with open(settings, "w") as f:
+        json.dump({"last_location": "Country 0 - City 0"}, f)
+    app = App(launch_env)
+    try:
+        tunnel, _ = app.wait("tunnel")
+        results["launch_to_tunnel_ms"] = tunnel["seconds"] * 1000
+    finally:
+        app.stop()
+        shutil.rmtree(launch_env["EXPRESSVPN_GUI_DATA_DIR"])
+
+    connect_env = install_fake(tempfile.mkdtemp(prefix="expressvpn-bench-"))
+    app = App(connect_env, connect="Country 0 - City 0", stalls="1")
+    try:
+        connecting, _ = app.wait("connection", state="connecting")
+        connected, seen = app.wait("connection", state="connected")
+        results["time_to_connected_ms"] = (
+            connected["elapsed"] - connecting["elapsed"]
+        ) * 1000
+        stalls = [event["duration"] for event in seen if event["event"] == "stall"]
+        results["connect_stalls"] = len(stalls)
+    finally:
+        app.stop()
+        shutil.rmtree(os.path.dirname(connect_env["FAKE_EXPRESSVPN_LOG"]))
+
+    return results
+
+
+def _has_gtk():
+    check = subprocess.run(
+        [sys.executable, "-c", "import gi; gi.require_version('Gtk', '3.0')"],
+        stderr=subprocess.DEVNULL,
+    )
+
+    return check.returncode == 0
+
+
+def _start_display():
+    if os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"):
+        return None
+    if not shutil.which("Xvfb"):
+        return None
+
+    display = ":97"
+    server = subprocess.Popen(
+        ["Xvfb", display, "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    os.environ["DISPLAY"] = display
+    time.sleep(1)
+
+    return server
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix="expressvpn-bench-")
+    server = None
+    try:
+        env = install_fake(directory)
+        results = core_benchmark(env)
+        if not _has_gtk():
+            print("GTK bindings not available, skipping application benchmarks")
+        else:
+            server = _start_display()
+            if os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"):
+                results.update(app_benchmark(env))
+            else:
+                print("No display and no Xvfb, skipping application benchmarks")
+    finally:
+        if server:
+            server.terminate()
+        shutil.rmtree(directory)
+
+    for name, value in results.items():
+        print(f"{name:<32} {value:12.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
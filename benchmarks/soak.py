@@ -0,0 +1,144 @@
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+from run import _has_gtk, _start_display, install_fake, rss_mb
+
+TICKS = int(os.environ.get("SOAK_TICKS", 20000))
+SAMPLES = int(os.environ.get("SOAK_SAMPLES", 20))
+SPAWN_EVERY = int(os.environ.get("SOAK_SPAWN_EVERY", 100))
+FLIP_EVERY = SPAWN_EVERY * 5
+RSS_GROWTH_MB = float(os.environ.get("SOAK_RSS_GROWTH_MB", 5))
+HEAP_GROWTH_MB = float(os.environ.get("SOAK_HEAP_GROWTH_MB", 1))
+OBJECT_GROWTH = int(os.environ.get("SOAK_OBJECT_GROWTH", 50))
+
+
+def gobject_count():
+    gobject = sys.modules.get("gi.repository.GObject")
+    if not gobject:
+        return 0
+
+    return sum(1 for o in gc.get_objects() if isinstance(o, gobject.Object))
+
+
+def flip_connection():
+    from fake_expressvpn import load_state, save_state
+
+    state = load_state()
+    state["location"] = None if state["location"] else "Country 0 - City 1"
+    save_state(state)
+
+
+def sample(tick):
+    gc.collect()
+
+    return {
+        "tick": tick,
+        "rss_mb": rss_mb(os.getpid()),
+        "heap_mb": tracemalloc.get_traced_memory()[0] / 1024 / 1024,
+        "gobjects": gobject_count(),
+    }
+
+
+def start_app():
+    import expressvpn
+    from gi.repository import Gtk
+
+    expressvpn.executor.dispatch = expressvpn._main_loop_dispatch
+    app = expressvpn.AppForm()
+    app.service.stop()
+
+    def pump():
+        while Gtk.events_pending():
+            Gtk.main_iteration_do(False)
+
+    return app.service, pump
+
+
+def start_service():
+    from daemon import StatusService
+
+    service = StatusService(outage_log=None)
+    service.subscribe(lambda snapshot: None)
+
+    return service, lambda: None
+
+
+def soak(gui=False):
+    from utils import executor
+
+    service, pump = start_app() if gui else start_service()
+    interval = max(TICKS // SAMPLES, 1)
+    samples = []
+
+    for tick in range(TICKS):
+        if tick % FLIP_EVERY == 0:
+            flip_connection()
+        if tick % SPAWN_EVERY == 0:
+            executor.invalidate()
+        service.poll()
+        pump()
+        if tick % interval == 0:
+            samples.append(sample(tick))
+    samples.append(sample(TICKS))
+
+    return samples
+
+
+def growth(samples, key):
+    quarter = max(len(samples) // 4, 1)
+    baseline = samples[quarter : quarter * 2] or samples[:1]
+    final = samples[-quarter:]
+
+    return sum(s[key] for s in final) / len(final) - sum(
+        s[key] for s in baseline
+    ) / len(baseline)
+
+
+def main():
+    gui = "--gui" in sys.argv[1:]
+    directory = tempfile.mkdtemp(prefix="expressvpn-soak-")
+    server = None
+    os.environ.update(install_fake(directory))
+    os.environ["EXPRESSVPN_GUI_PROBE_MODE"] = "passive"
+    os.environ["EXPRESSVPN_GUI_SOCKET"] = os.path.join(directory, "daemon.sock")
+    try:
+        if gui:
+            if not _has_gtk():
+                print("GTK bindings not available")
+                return 2
+            server = _start_display()
+        tracemalloc.start()
+        samples = soak(gui=gui)
+    finally:
+        if server:
+            server.terminate()
+        shutil.rmtree(directory)
+
+    print(f"{'tick':>8} {'rss_mb':>10} {'heap_mb':>10} {'gobjects':>10}")
+    for s in samples:
+        print(
+            f"{s['tick']:>8} {s['rss_mb']:>10.2f} {s['heap_mb']:>10.3f} "
+            f"{s['gobjects']:>10}"
+        )
+
+    limits = {
+        "rss_mb": RSS_GROWTH_MB,
+        "heap_mb": HEAP_GROWTH_MB,
+        "gobjects": OBJECT_GROWTH,
+    }
+    failed = False
+    for key, limit in limits.items():
+        value = growth(samples, key)
+        status = "FAIL" if value > limit else "ok"
+        failed = failed or value > limit
+        print(f"{key + '_growth':<20} {value:12.3f} (limit {limit}) {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from run import install_fake
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(DIR, "expressvpn.py")
+RUNS = int(os.environ.get("BENCHMARK_RUNS", 10))
+BUDGET = 0.3
+
+
+def time_to_event(event, env=None):
+    # Keep the real CLI, settings and a running daemon out of the measurement
+    directory = tempfile.mkdtemp(prefix="expressvpn-startup-")
+    env = dict(install_fake(directory), EXPRESSVPN_GUI_BENCHMARK="1", **(env or {}))
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, APP], stdout=subprocess.PIPE, env=env, text=True
+    )
+    try:
+        for line in process.stdout:
+            data = json.loads(line)
+            if data["event"] == event:
+                return time.monotonic() - started
+    finally:
+        process.kill()
+        process.wait()
+        shutil.rmtree(directory)
+
+    raise RuntimeError(f"{APP} exited before reporting {event!r}")
+
+
+def main():
+    samples = sorted(time_to_event("tray") for _ in range(RUNS))
+    median = statistics.median(samples)
+    print(f"time-to-tray over {RUNS} runs")
+    print(f"  min    {samples[0] * 1000:8.1f} ms")
+    print(f"  median {median * 1000:8.1f} ms")
+    print(f"  max    {samples[-1] * 1000:8.1f} ms")
+
+    return 0 if median <= BUDGET else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,678 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from subprocess import SubprocessError, TimeoutExpired
+from threading import Event, Lock, Thread
+
+from history import ConnectHistory
+from reconnect import ReconnectWatchdog
+from utils import (
+    CONNECTING,
+    DISCONNECTED,
+    DISCONNECTING,
+    POLL_HIDDEN_INTERVAL,
+    POLL_MAX_INTERVAL,
+    check_errors,
+    executor,
+    get_preferences_dict,
+    get_status,
+    ConnectionStateMachine,
+    PollingScheduler,
+    PreferenceWriter,
+)
+
+SOCKET = os.environ.get(
+    "EXPRESSVPN_GUI_SOCKET",
+    os.path.join(
+        os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+        f"expressvpn-gui-{os.getuid()}.sock",
+    ),
+)
+DATA_DIR = os.environ.get(
+    "EXPRESSVPN_GUI_DATA_DIR", os.path.dirname(os.path.abspath(__file__))
+)
+OUTAGE_LOG = os.path.join(DATA_DIR, "outages.jsonl")
+HISTORY_LOG = os.path.join(DATA_DIR, "history.jsonl")
+AUTO_RECONNECT = os.environ.get("EXPRESSVPN_GUI_AUTO_RECONNECT") == "1"
+AUTO_PROTOCOL = os.environ.get("EXPRESSVPN_GUI_AUTO_PROTOCOL") == "1"
+WATCHDOG_MAX_INTERVAL = 5
+SOCKET_TIMEOUT = 2
+REQUEST_TIMEOUT = 15
+RECONNECT_INTERVAL = 2
+SUBSCRIBER_TIMEOUT = 5
+FALLBACK_AFTER = 3
+
+
+class ConnectionView(
+    namedtuple("ConnectionView", ["state", "location", "elapsed", "progress"])
+):
+    @property
+    def busy(self):
+        return self.state in (CONNECTING, DISCONNECTING)
+
+
+IDLE_CONNECTION = ConnectionView(DISCONNECTED, None, 0, 1)
+
+
+def _direct(function, *args):
+    function(*args)
+
+
+class StatusService:
+    def __init__(
+        self,
+        auto_reconnect=AUTO_RECONNECT,
+        outage_log=OUTAGE_LOG,
+        auto_protocol=AUTO_PROTOCOL,
+        history_log=HISTORY_LOG,
+    ):
+        self.connection = ConnectionStateMachine()
+        self.connection.subscribe(self._connection_changed)
+        self.watchdog = ReconnectWatchdog(
+            self, enabled=auto_reconnect, log_file=outage_log
+        )
+        self.history = ConnectHistory(history_log)
+        self.auto_protocol = auto_protocol
+        self.thread = None
+        self.status = None
+        self.preferences = None
+        self.error = None
+        self.hidden = False
+        self.remote_subscribers = 0
+        self.listeners = []
+        self.on_poll = None
+        self.preference_writer = PreferenceWriter(self._preference_done)
+        self.preference_error = None
+        self.lock = Lock()
+        self.subscribe(self.watchdog.observe, dispatch=_direct)
+        self.subscribe(self.history.observe, dispatch=_direct)
+
+    def start(self):
+        self.stop()
+        self.thread = PollingScheduler(self.poll)
+        self._apply_hidden()
+        self._apply_watchdog_interval()
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.thread.cancel()
+            self.thread = None
+
+    def subscribe(self, listener, dispatch=None):
+        self.listeners.append((listener, dispatch))
+
+    def unsubscribe(self, listener):
+        self.listeners = [entry for entry in self.listeners if entry[0] != listener]
+
+    def snapshot(self):
+        connection = self.connection
+        with self.lock:
+            status = self.status._asdict() if self.status else None
+            preferences = self.preferences
+            error = self.error
+            preference_error = self.preference_error
+
+        return {
+            "status": status,
+            "preferences": preferences,
+            "error": error,
+            "auto_reconnect": self.watchdog.enabled,
+            "auto_protocol": self.auto_protocol,
+            "pending_preferences": self.preference_writer.values(),
+            "preference_error": preference_error,
+            "connection": ConnectionView(
+                connection.state,
+                connection.location,
+                connection.elapsed,
+                connection.progress,
+            )._asdict(),
+        }
+
+    def poll(self):
+        try:
+            # The poller sets the pace, it only joins a read already running
+            status = get_status(fresh=True)
+        except TimeoutExpired:
+            return False
+
+        error = check_errors(update=True, status=status)
+        preferences = self.preferences
+        if not error:
+            try:
+                preferences = get_preferences_dict()
+            except (OSError, SubprocessError):
+                pass
+        with self.lock:
+            changed = (status, preferences, error) != (
+                self.status,
+                self.preferences,
+                self.error,
+            )
+            self.status = status
+            self.preferences = preferences
+            self.error = error
+        if not error:
+            self.connection.update(status)
+        if changed:
+            self._publish()
+        if self.on_poll:
+            self.on_poll(changed)
+
+        return changed
+
+    def refresh(self):
+        self.poll()
+
+        return self.snapshot()
+
+    def wake(self):
+        if self.thread:
+            self.thread.wake()
+
+    def set_hidden(self, hidden):
+        self.hidden = hidden
+        self._apply_hidden()
+
+    def add_remote_subscriber(self):
+        with self.lock:
+            self.remote_subscribers += 1
+        self._apply_hidden()
+
+    def remove_remote_subscriber(self):
+        with self.lock:
+            self.remote_subscribers -= 1
+        self._apply_hidden()
+
+    def _apply_hidden(self):
+        # A hidden window only slows polling down when no socket client is
+        # watching, they would otherwise see the hidden rate too
+        thread = self.thread
+        if thread:
+            with self.lock:
+                hidden = self.hidden and not self.remote_subscribers
+            thread.set_hidden(hidden)
+
+    def connect(self, location):
+        protocol = None
+        if self.auto_protocol:
+            protocol = self.history.fastest(location)
+            with self.lock:
+                current = (self.preferences or {}).get("preferred_protocol")
+            if protocol == current:
+                protocol = None
+
+        return self.connection.connect(location, protocol)
+
+    def disconnect(self):
+        return self.connection.disconnect()
+
+    def cancel(self):
+        return self.connection.cancel()
+
+    def set_auto_reconnect(self, enabled):
+        self.watchdog.set_enabled(enabled)
+        self._apply_watchdog_interval()
+        self._publish()
+
+    def _apply_watchdog_interval(self):
+        # Bound how long a dropped tunnel can go unnoticed while watched,
+        # also when the window is hidden
+        if not self.thread:
+            return
+        enabled = self.watchdog.enabled
+        self.thread.max_interval = (
+            WATCHDOG_MAX_INTERVAL if enabled else POLL_MAX_INTERVAL
+        )
+        self.thread.hidden_interval = (
+            WATCHDOG_MAX_INTERVAL if enabled else POLL_HIDDEN_INTERVAL
+        )
+        self.thread.interval = min(self.thread.interval, self.thread.max_interval)
+
+    def outages(self):
+        return list(self.watchdog.outages)
+
+    def set_auto_protocol(self, enabled):
+        self.auto_protocol = enabled
+        self._publish()
+
+    def history_summary(self, location=None):
+        return self.history.summary(location)
+
+    def set_protocol(self, protocol):
+        self._set_preference("preferred_protocol", protocol)
+
+    def set_network_lock(self, network_lock):
+        self._set_preference("network_lock", network_lock)
+
+    def _set_preference(self, key, value):
+        with self.lock:
+            if self.preference_error and self.preference_error["key"] == key:
+                self.preference_error = None
+        self.preference_writer.request(key, value)
+        self._publish()
+
+    def _preference_done(self, key, value, preferences, error):
+        with self.lock:
+            if preferences is not None:
+                self.preferences = preferences
+            if error:
+                self.preference_error = {"key": key, "value": value, "error": error}
+        self._publish()
+
+    def _connection_changed(self, connection):
+        if self.thread:
+            self.thread.set_transition(connection.busy)
+        self._publish()
+
+    def _publish(self):
+        snapshot = self.snapshot()
+        for listener, dispatch in self.listeners:
+            (dispatch or executor.dispatch)(listener, snapshot)
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super(_RequestHandler, self).setup()
+        self.write_lock = Lock()
+        self.subscribed = False
+        self.pending = None
+        self.sending_since = None
+        self.outbox_ready = Event()
+        self.outbox_lock = Lock()
+        self.finished = False
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                if not self.push(self._reply(line)):
+                    break
+        except OSError:
+            pass
+
+    def _reply(self, line):
+        request = None
+        try:
+            request = json.loads(line)
+            result = self.server.dispatch_request(self, request)
+        except Exception as error:
+            request_id = request.get("id") if isinstance(request, dict) else None
+            return {"id": request_id, "ok": False, "error": str(error)}
+
+        return {"id": request.get("id"), "ok": True, "result": result}
+
+    def finish(self):
+        if self.subscribed:
+            self.server.service.unsubscribe(self.publish)
+            self.server.service.remove_remote_subscriber()
+            self.finished = True
+            self.outbox_ready.set()
+        super(_RequestHandler, self).finish()
+
+    def subscribe(self):
+        if self.subscribed:
+            return
+        self.subscribed = True
+        Thread(target=self._write_events, daemon=True).start()
+        self.server.service.subscribe(self.publish, dispatch=_direct)
+        self.server.service.add_remote_subscriber()
+
+    def _write_events(self):
+        while True:
+            self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            if self.finished:
+                return
+            with self.outbox_lock:
+                message, self.pending = self.pending, None
+                self.sending_since = time.monotonic()
+            sent = message is None or self.push(message)
+            with self.outbox_lock:
+                self.sending_since = None
+            if not sent:
+                return
+
+    def _drop(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def push(self, message):
+        with self.write_lock:
+            try:
+                _send(self.connection, message)
+            except OSError:
+                return False
+
+        return True
+
+    def publish(self, snapshot):
+        # Runs on the poller or GTK thread, so never wait on the client.
+        # Snapshots carry the full state, only the latest one is kept
+        with self.outbox_lock:
+            since = self.sending_since
+            self.pending = {"event": "snapshot", "snapshot": snapshot}
+        if since is not None and time.monotonic() - since > SUBSCRIBER_TIMEOUT:
+            # The client stopped reading, drop it
+            self.server.service.unsubscribe(self.publish)
+            self._drop()
+            return
+        self.outbox_ready.set()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.path = path
+        self.service = service
+        _remove_stale_socket(path)
+        super(DaemonServer, self).__init__(path, _RequestHandler)
+        os.chmod(path, 0o600)
+
+    def dispatch_request(self, handler, request):
+        command = request.get("command")
+        service = self.service
+
+        if command == "snapshot":
+            return service.snapshot()
+        if command == "refresh":
+            return service.refresh()
+        if command == "subscribe":
+            handler.subscribe()
+            return service.snapshot()
+        if command == "connect":
+            return service.connect(request["location"])
+        if command == "disconnect":
+            return service.disconnect()
+        if command == "cancel":
+            return service.cancel()
+        if command == "set_auto_reconnect":
+            return service.set_auto_reconnect(bool(request["enabled"]))
+        if command == "outages":
+            return service.outages()
+        if command == "set_auto_protocol":
+            return service.set_auto_protocol(bool(request["enabled"]))
+        if command == "history":
+            return service.history_summary(request.get("location"))
+        if command == "set_protocol":
+            return service.set_protocol(request["protocol"])
+        if command == "set_network_lock":
+            return service.set_network_lock(request["network_lock"])
+
+        raise ValueError(f"unknown command: {command}")
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    if _probe_socket(path):
+        raise OSError(f"another daemon is listening on {path}")
+    os.unlink(path)
+
+
+def _probe_socket(path):
+    try:
+        _open_socket(path).close()
+        return True
+    except OSError:
+        return False
+
+
+def _open_socket(path):
+    # The fallback path in /tmp is predictable, only trust a daemon that runs
+    # as the current user
+    info = os.lstat(path)
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a socket owned by this user")
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(SOCKET_TIMEOUT)
+    try:
+        sock.connect(path)
+        if hasattr(socket, "SO_PEERCRED"):
+            size = struct.calcsize("3i")
+            credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size)
+            if struct.unpack("3i", credentials)[1] != os.getuid():
+                raise PermissionError(f"{path} is served by another user")
+    except OSError:
+        sock.close()
+        raise
+
+    return sock
+
+
+class DaemonClient:
+    def __init__(self, path=SOCKET):
+        self.path = path
+        self.sock = None
+        self.reader = None
+        self.counter = 0
+        self.listeners = []
+        self.on_lost = None
+        self.finished = Event()
+        self.listen_sock = None
+        self.lock = Lock()
+
+    def _open(self):
+        return _open_socket(self.path)
+
+    def request(self, command, **args):
+        with self.lock:
+            if self.sock is None:
+                self.sock = self._open()
+                self.sock.settimeout(REQUEST_TIMEOUT)
+                self.reader = self.sock.makefile("r")
+            self.counter += 1
+            try:
+                _send(self.sock, dict(args, id=self.counter, command=command))
+                reply = json.loads(self.reader.readline())
+            except (OSError, ValueError):
+                self.sock.close()
+                self.sock = None
+                raise ConnectionError(f"lost connection to {self.path}")
+
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error"))
+
+        return reply.get("result")
+
+    def start(self):
+        self.stop()
+        # Each listener thread gets its own flag, so a restart cannot revive
+        # the previous one
+        self.finished = Event()
+        Thread(target=self._listen, args=(self.finished,), daemon=True).start()
+
+    def stop(self):
+        self.finished.set()
+        sock, self.listen_sock = self.listen_sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def subscribe(self, listener, dispatch=None):
+        self.listeners.append((listener, dispatch))
+
+    def _listen(self, finished):
+        failures = 0
+        while not finished.is_set():
+            try:
+                sock = self._open()
+            except OSError:
+                failures += 1
+                if failures >= FALLBACK_AFTER and self.on_lost:
+                    # The daemon is gone, let the owner take over
+                    finished.set()
+                    executor.dispatch(self.on_lost)
+                    return
+                finished.wait(RECONNECT_INTERVAL)
+                continue
+
+            failures = 0
+            self.listen_sock = sock
+            try:
+                if finished.is_set():
+                    break
+                sock.settimeout(None)
+                _send(sock, {"id": 0, "command": "subscribe"})
+                for line in sock.makefile("r"):
+                    if finished.is_set():
+                        break
+                    message = json.loads(line)
+                    snapshot = message.get("snapshot") or message.get("result")
+                    if snapshot:
+                        self._publish(snapshot)
+            except (OSError, ValueError):
+                pass
+            finally:
+                sock.close()
+            finished.wait(RECONNECT_INTERVAL)
+
+    def _publish(self, snapshot):
+        for listener, dispatch in self.listeners:
+            (dispatch or executor.dispatch)(listener, snapshot)
+
+    def snapshot(self):
+        return self.request("snapshot")
+
+    def refresh(self):
+        return self.request("refresh")
+
+    def wake(self):
+        executor.submit(self.request, "refresh")
+
+    def set_hidden(self, hidden):
+        if not hidden:
+            self.wake()
+
+    def connect(self, location):
+        return executor.submit(self.request, "connect", location=location)
+
+    def disconnect(self):
+        executor.submit(self.request, "disconnect")
+
+    def cancel(self):
+        executor.submit(self.request, "cancel")
+
+    def set_auto_reconnect(self, enabled):
+        executor.submit(self.request, "set_auto_reconnect", enabled=enabled)
+
+    def outages(self):
+        return self.request("outages")
+
+    def set_auto_protocol(self, enabled):
+        executor.submit(self.request, "set_auto_protocol", enabled=enabled)
+
+    def history_summary(self, location=None):
+        return self.request("history", location=location)
+
+    def set_protocol(self, protocol):
+        executor.submit(self.request, "set_protocol", protocol=protocol)
+
+    def set_network_lock(self, network_lock):
+        executor.submit(self.request, "set_network_lock", network_lock=network_lock)
+
+
+def connect_service(path=SOCKET, serve=True):
+    if _probe_socket(path):
+        return DaemonClient(path), None
+
+    service = StatusService()
+    server = None
+    if serve:
+        try:
+            server = DaemonServer(path, service)
+            server.start()
+        except OSError:
+            server = None
+
+    return service, server
+
+
+def serve(path=SOCKET):
+    service = StatusService()
+    try:
+        server = DaemonServer(path, service)
+    except OSError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    signal.signal(signal.SIGTERM, lambda *_: Thread(target=server.shutdown).start())
+    service.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    return 0
+
+
+def main(args):
+    if not args:
+        return serve()
+
+    client = DaemonClient()
+    command, *rest = args
+    if command == "subscribe":
+        client.subscribe(lambda snapshot: print(json.dumps(snapshot), flush=True))
+        client.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return 0
+
+    names = {
+        "connect": "location",
+        "set_protocol": "protocol",
+        "set_network_lock": "network_lock",
+        "history": "location",
+    }
+    arguments = {names[command]: rest[0]} if command in names and rest else {}
+    if command in ("set_auto_reconnect", "set_auto_protocol"):
+        arguments = {"enabled": bool(rest) and rest[0] in ("1", "on", "true")}
+    try:
+        print(json.dumps(client.request(command, **arguments), indent=2))
+    except (OSError, RuntimeError) as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+import traceback
+from functools import wraps
+from threading import Event, Lock, Thread, main_thread
+
+from metrics import registry
+
+DIAGNOSTICS = (
+    "--diagnostics" in sys.argv[1:]
+    or os.environ.get("EXPRESSVPN_GUI_DIAGNOSTICS") == "1"
+)
+PROFILE = "--profile" in sys.argv[1:] or os.environ.get("EXPRESSVPN_GUI_PROFILE") == "1"
+STALL_MS = int(os.environ.get("EXPRESSVPN_GUI_STALL_MS", 200))
+PROFILE_LIMIT = 40
+
+
+def _timestamp():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _append(path, content):
+    if not path:
+        return
+
+    try:
+        with open(path, "a") as f:
+            f.write(content)
+    except OSError:
+        pass
+
+
+class StallWatchdog:
+    def __init__(self, threshold=STALL_MS / 1000, report_path=None, on_stall=None):
+        self.threshold = threshold
+        self.report_path = report_path
+        self.on_stall = on_stall
+        self.interval = threshold / 4
+        self.last_beat = time.monotonic()
+        self.stalled = False
+        self.ident = main_thread().ident
+        self.finished = Event()
+        self.lock = Lock()
+
+    def start(self):
+        self.last_beat = time.monotonic()
+        Thread(target=self._run, name="stall-watchdog", daemon=True).start()
+
+    def stop(self):
+        self.finished.set()
+
+    def beat(self):
+        now = time.monotonic()
+        with self.lock:
+            stalled, self.stalled = self.stalled, False
+            started, self.last_beat = self.last_beat, now
+        if stalled:
+            duration = now - started
+            registry.observe_timing("main_loop_stall", duration)
+            _append(
+                self.report_path,
+                f"{_timestamp()} main loop stall ended after {duration:.3f}s\n\n",
+            )
+            if self.on_stall:
+                self.on_stall(duration)
+
+        return True
+
+    def _run(self):
+        while not self.finished.wait(self.interval):
+            with self.lock:
+                blocked = time.monotonic() - self.last_beat
+                if self.stalled or blocked < self.threshold:
+                    continue
+                self.stalled = True
+            self._capture(blocked)
+
+    def _capture(self, blocked):
+        # Taken while the main thread is still stuck, so this is the culprit
+        frame = sys._current_frames().get(self.ident)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        registry.increment("main_loop_stalls")
+        _append(
+            self.report_path,
+            f"{_timestamp()} main loop blocked for {blocked:.3f}s\n{stack}",
+        )
+
+
+class Profiler:
+    def __init__(self, report_path=None, limit=PROFILE_LIMIT):
+        self.report_path = report_path
+        self.limit = limit
+        self.profiles = {}
+        self.calls = {}
+
+    def wrap(self, name, function, thread="main"):
+        # cProfile only follows the thread that enabled it, so functions that
+        # run on another thread get a profile of their own
+        if thread not in self.profiles:
+            self.profiles[thread] = (cProfile.Profile(), Lock())
+        profile, lock = self.profiles[thread]
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            # Nested calls are already covered by the outer one, and a
+            # profile can only be active on one thread at a time
+            if not lock.acquire(blocking=False):
+                return function(*args, **kwargs)
+
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one active profiler per process
+                lock.release()
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+                lock.release()
+
+        return wrapper
+
+    def report(self):
+        stream = io.StringIO()
+        calls = ", ".join(f"{name}: {count}" for name, count in self.calls.items())
+        stream.write(f"{_timestamp()} profiled calls: {calls or 'none'}\n")
+        for thread, (profile, _) in self.profiles.items():
+            if not profile.getstats():
+                continue
+            stream.write(f"\n{thread} thread\n")
+            stats = pstats.Stats(profile, stream=stream)
+            stats.sort_stats("cumulative").print_stats(self.limit)
+
+        return stream.getvalue()
+
+    def write(self):
+        if not self.report_path:
+            return
+
+        try:
+            with open(self.report_path, "w") as f:
+                f.write(self.report())
+        except OSError:
+            pass
@@ -1,39 +1,145 @@
-import gi
+import json
 import os
+import signal
+import sys
+import time
+from collections import namedtuple
 from functools import partial
+from subprocess import TimeoutExpired
+
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    # Keep the headless daemon free of any GTK dependency
+    from daemon import serve
+
+    sys.exit(serve())
+
+import gi
 
 gi.require_version("Gtk", "3.0")
 gi.require_version("AppIndicator3", "0.1")
-from gi.repository import AppIndicator3, GdkPixbuf, GLib, Gtk
+from gi.repository import AppIndicator3, Gdk, GdkPixbuf, GLib, Gtk
 
+from daemon import (
+    IDLE_CONNECTION,
+    ConnectionView,
+    DaemonClient,
+    StatusService,
+    connect_service,
+)
+from diagnostics import DIAGNOSTICS, PROFILE, Profiler, StallWatchdog
+from metrics import registry
+from network import latency
+from settings import SettingsStore
 from utils import (
+    CONNECTED,
+    CONNECTING,
+    DISCONNECTING,
+    FAILED,
+    TIMED_OUT,
     activate_command,
+    catalog,
     check_connection,
-    check_daemon,
-    check_expressvpn,
-    connect_command,
     disconnect_command,
-    get_active_location,
-    get_location_key,
-    get_locations_list,
     get_protocol_list,
-    get_preferences_dict,
-    get_settings,
+    get_version,
     is_activated,
     is_connected,
-    set_network_lock,
-    set_protocol,
-    set_settings,
-    RepeatingTimer,
+    load_cache,
+    get_status,
+    save_cache,
+    executor,
 )
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 ICON = os.path.join(DIR, "assets/icon.png")
 ICON_ACTIVE = os.path.join(DIR, "assets/icon_active.png")
 LOGO = os.path.join(DIR, "assets/logo.png")
-SETTINGS = os.path.join(DIR, "settings.dat")
+LOGO_SIZE = (280, 200)
+DATA_DIR = os.environ.get("EXPRESSVPN_GUI_DATA_DIR", DIR)
+SCALED_LOGO = os.path.join(DATA_DIR, "logo-{}x{}.png".format(*LOGO_SIZE))
+SETTINGS = os.path.join(DATA_DIR, "settings.json")
+LEGACY_SETTINGS = os.path.join(DATA_DIR, "settings.dat")
+CACHE = os.path.join(DATA_DIR, "cache.json")
+METRICS_DUMP = os.path.join(DATA_DIR, "metrics.json")
+PROMETHEUS_TEXTFILE = os.environ.get("EXPRESSVPN_GUI_PROMETHEUS_TEXTFILE")
+METRICS_INTERVAL = 15
+STALL_REPORT = os.path.join(DATA_DIR, "stalls.log")
+PROFILE_REPORT = os.path.join(DATA_DIR, "profile.txt")
+PROFILE_INTERVAL = 60
+TRAY_ONLY = (
+    "--tray-only" in sys.argv[1:] or os.environ.get("EXPRESSVPN_GUI_TRAY_ONLY") == "1"
+)
+WINDOW_RELEASE_DELAY = 300
+CONNECT_ON_LAUNCH = os.environ.get("EXPRESSVPN_GUI_CONNECT_ON_LAUNCH") == "1"
 TITLE = "ExpressVPN GUI"
-UPDATE_INTERVAL = 2
+BENCHMARK = os.environ.get("EXPRESSVPN_GUI_BENCHMARK")
+BENCHMARK_CONNECT = os.environ.get("EXPRESSVPN_GUI_BENCHMARK_CONNECT")
+BENCHMARK_STALLS = os.environ.get("EXPRESSVPN_GUI_BENCHMARK_STALLS")
+CACHED_PROBES = {
+    "protocols": "protocols",
+    "locations": "locations",
+    "status": "preferences",
+}
+HISTORY_PROTOCOL = "history"
+PREFERENCE_LABELS = {"network_lock": "network lock", "preferred_protocol": "protocol"}
+START_TIME = time.monotonic()
+
+ViewState = namedtuple(
+    "ViewState",
+    [
+        "connected",
+        "button_label",
+        "tray_label",
+        "icon",
+        "location",
+        "network_lock",
+        "protocol",
+    ],
+)
+
+
+def load_logo():
+    try:
+        if os.path.getmtime(SCALED_LOGO) >= os.path.getmtime(LOGO):
+            return GdkPixbuf.Pixbuf.new_from_file(SCALED_LOGO)
+    except (OSError, GLib.Error):
+        pass
+
+    logo = GdkPixbuf.Pixbuf.new_from_file(LOGO)
+    logo = logo.scale_simple(*LOGO_SIZE, GdkPixbuf.InterpType.BILINEAR)
+    try:
+        logo.savev(SCALED_LOGO, "png", [], [])
+    except GLib.Error:
+        pass
+
+    return logo
+
+
+def format_history(location, rows):
+    lines = []
+    for row in rows:
+        if not row["attempts"]:
+            continue
+        failed = f"{row['failures']}/{row['attempts']} failed"
+        if row["p50"] is None:
+            lines.append(f"{row['protocol']}: {failed}")
+        else:
+            lines.append(
+                f"{row['protocol']}: {row['p50']:.1f}s median, "
+                f"{row['p90']:.1f}s p90, {failed}"
+            )
+    if not lines:
+        return ""
+
+    return "\n".join([f"Connect history for {location}:"] + lines)
+
+
+def benchmark_event(event, **data):
+    if not BENCHMARK:
+        return
+
+    data.update(event=event, elapsed=time.monotonic() - START_TIME)
+    print(json.dumps(data), flush=True)
 
 
 class AppForm(Gtk.Window):
@@ -46,80 +152,358 @@ class AppForm(Gtk.Window):
         self.tray_menu = Gtk.Menu()
         self.tray_quit = Gtk.MenuItem(label="Quit")
         self.tray_status = Gtk.MenuItem(label="Disconnected")
-        self.tray_status_handler = None
         self.tray_open = Gtk.MenuItem(label="Open")
-        # Create UI elements
-        self.grid = Gtk.Grid(
-            orientation=Gtk.Orientation.VERTICAL,
-            column_spacing=10,
-            row_spacing=10,
-            margin=60,
-        )
-        self.connect_button = Gtk.Button()
-        self.connect_handler = None
-        self.location_label = Gtk.Label()
-        self.location_combo = Gtk.ComboBoxText()
-        self.logo = GdkPixbuf.Pixbuf.new_from_file(LOGO)
-        self.logo_image = Gtk.Image()
-        self.protocol_label = Gtk.Label()
-        self.protocol_combo = Gtk.ComboBoxText()
-        self.network_lock_combo = Gtk.ComboBoxText()
-        self.thread = None
-        self.update_timer = None
+        self.tray_fastest = Gtk.MenuItem(label="Connect to fastest")
+        self.tray_reconnect = Gtk.CheckMenuItem(label="Auto-reconnect")
+        self.tray_launch = Gtk.CheckMenuItem(label="Connect on launch")
+        self.tray_locations = Gtk.MenuItem(label="Quick connect")
+        self.tray_locations_menu = Gtk.Menu()
+        self.tray_quick_fastest = Gtk.MenuItem(label="Fastest")
+        self.tray_quick_separator = Gtk.SeparatorMenuItem()
+        self.tray_favorite = Gtk.CheckMenuItem()
+        self.quick_items = {}
+        self.quick_state = None
+        self.quick_sensitive = True
+        # UI elements are created by _build_window
+        self.grid = None
+        self.connect_button = None
+        self.fastest_button = None
+        self.location_label = None
+        self.location_picker = None
+        self.history_label = None
+        self.logo_image = None
+        self.protocol_label = None
+        self.protocol_combo = None
+        self.network_lock_combo = None
+        self.release_timer = None
+        self.service, self.server = connect_service()
+        self.connection = IDLE_CONNECTION
         self.block_update_ui = False
-        self.block_update_event = False
+        self.error_type = None
+        self.cache = {}
+        self.settings = SettingsStore(SETTINGS, legacy_path=LEGACY_SETTINGS)
+        self.probing = set()
         self.updates = {}
+        self.optimistic = {}
+        self.rendered = None
+        self.network_lock_handler = None
+        self.protocol_handler = None
+        self.reconnect_handler = None
+        self.favorite_handler = None
+        self.prewarming = False
+        self.metrics_window = None
+        self.watchdog = None
+        self.profiler = None
         # Configure App
         self.configure()
 
     def configure(self):
+        self._configure_diagnostics()
         # System tray
         self.tray.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
         self.tray.set_title(TITLE)
         self.tray_open.connect("activate", self._focus_event)
         self.tray_quit.connect("activate", self._quit_event)
+        self.tray_status.connect("activate", self._tray_status_event)
+        self.tray_fastest.connect("activate", self._connect_fastest_event)
+        self.tray_reconnect.set_active(self.settings.get("auto_reconnect"))
+        self.reconnect_handler = self.tray_reconnect.connect(
+            "toggled", self._auto_reconnect_event
+        )
+        self.tray_quick_fastest.connect("activate", self._connect_fastest_event)
+        self.favorite_handler = self.tray_favorite.connect(
+            "toggled", self._favorite_event
+        )
+        self.tray_locations_menu.append(self.tray_quick_fastest)
+        self.tray_locations_menu.append(self.tray_quick_separator)
+        self.tray_locations_menu.append(self.tray_favorite)
+        self.tray_locations.set_submenu(self.tray_locations_menu)
         self.tray_menu.append(self.tray_status)
+        self.tray_menu.append(self.tray_fastest)
+        self.tray_menu.append(self.tray_locations)
+        self.tray_launch.set_active(self.settings.get("connect_on_launch"))
+        self.tray_launch.connect("toggled", self._connect_on_launch_event)
+        self.tray_menu.append(self.tray_reconnect)
+        self.tray_menu.append(self.tray_launch)
         self.tray_menu.append(self.tray_open)
         self.tray_menu.append(Gtk.SeparatorMenuItem())
         self.tray_menu.append(self.tray_quit)
         self.tray_menu.show_all()
         self.tray.set_menu(self.tray_menu)
-        # Main UI
-        self.set_default_size(400, 500)
+        GLib.idle_add(self._tray_ready)
+        self._configure_window()
+        # Main UI is built once the tray is up, from cached data, or on
+        # first open in tray-only mode
+        if not TRAY_ONLY:
+            GLib.idle_add(self._build_window)
+        self._attach_service()
+        self._start_probes()
+        self._update_quick_connect()
+        if CONNECT_ON_LAUNCH or self.settings.get("connect_on_launch"):
+            self._prewarm()
+        self._start_polling()
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, self._dump_metrics)
+        if PROMETHEUS_TEXTFILE:
+            GLib.timeout_add_seconds(METRICS_INTERVAL, self._export_metrics)
+
+    def _attach_service(self):
+        if self.profiler and isinstance(self.service, StatusService):
+            # Polls run on the poller thread, wrapped before it starts
+            self.service.poll = self.profiler.wrap(
+                "poll", self.service.poll, thread="poller"
+            )
+        self.service.subscribe(self._service_event)
+        self.service.on_poll = lambda changed: benchmark_event("tick", changed=changed)
+        if isinstance(self.service, DaemonClient):
+            self.service.on_lost = self._service_lost
+        if self.settings.get("auto_reconnect"):
+            self.service.set_auto_reconnect(True)
+        if self.settings.get("auto_protocol"):
+            self.service.set_auto_protocol(True)
+
+    def _service_lost(self):
+        # The shared daemon went away, host the status service here instead
+        self.service.stop()
+        self.service, self.server = connect_service()
+        self._attach_service()
+        self._start_polling()
+        self.service.wake()
+
+    def _configure_diagnostics(self):
+        if PROFILE:
+            # Bound methods are swapped before anything holds on to them
+            self.profiler = Profiler(PROFILE_REPORT)
+            self._service_event = self.profiler.wrap(
+                "_service_event", self._service_event
+            )
+            self._update_ui = self.profiler.wrap("_update_ui", self._update_ui)
+            GLib.timeout_add_seconds(PROFILE_INTERVAL, self._write_profile)
+        if DIAGNOSTICS or BENCHMARK_STALLS:
+            # The benchmark's stall events come from the same detector, it is
+            # only on for the phases that look at them
+            self.watchdog = StallWatchdog(
+                report_path=STALL_REPORT if DIAGNOSTICS else None,
+                on_stall=lambda duration: benchmark_event("stall", duration=duration),
+            )
+            GLib.timeout_add(int(self.watchdog.interval * 1000), self.watchdog.beat)
+            self.watchdog.start()
+
+    def _write_profile(self):
+        self.profiler.write()
+
+        return True
+
+    def _configure_window(self):
+        self.set_default_size(400, 720)
         self.set_resizable(False)
         self.set_icon_from_file(ICON)
         self.connect("delete-event", lambda w, e: w.hide() or True)
-        preferences = get_preferences_dict()
+        self.connect("show", lambda _: self.service.set_hidden(False))
+        self.connect("show", lambda _: self._measure_latency())
+        self.connect("hide", lambda _: self.service.set_hidden(True))
+        self.connect("hide", self._remember_window)
+        self.connect("key-press-event", self._key_press_event)
+        if TRAY_ONLY:
+            self.connect("show", self._cancel_release)
+            self.connect("hide", self._schedule_release)
+
+    def _build_window(self):
+        if self.grid:
+            return False
+
+        self.grid = Gtk.Grid(
+            orientation=Gtk.Orientation.VERTICAL,
+            column_spacing=10,
+            row_spacing=10,
+            margin=60,
+        )
+        self.connect_button = Gtk.Button()
+        self.fastest_button = Gtk.Button()
+        self.location_label = Gtk.Label()
+        self.location_picker = LocationPicker(
+            on_activate=self._location_activated, on_select=self._show_history
+        )
+        self.history_label = Gtk.Label(xalign=0)
+        self.logo_image = Gtk.Image.new_from_pixbuf(load_logo())
+        self.protocol_label = Gtk.Label()
+        self.protocol_combo = Gtk.ComboBoxText()
+        self.network_lock_combo = Gtk.ComboBoxText()
         self.connect_button.set_property("height-request", 48)
+        self.connect_button.connect("clicked", self._connect_button_event)
+        self.fastest_button.set_label("Connect to fastest")
+        self.fastest_button.connect("clicked", self._connect_fastest_event)
         self.network_lock_combo.set_property("height-request", 32)
         for item in ["default", "strict", "off"]:
             self.network_lock_combo.append(item, item)
-        self.set_active_item(self.network_lock_combo, preferences["network_lock"])
-        self.network_lock_combo.connect("changed", self._network_lock_change)
+        self.network_lock_handler = self.network_lock_combo.connect(
+            "changed", self._network_lock_change
+        )
         self.protocol_label.set_label("Protocol and network lock:")
         self.protocol_combo.set_property("height-request", 32)
-        for item in get_protocol_list():
-            self.protocol_combo.append(item, item)
-        self.set_active_item(self.protocol_combo, preferences["preferred_protocol"])
-        self.protocol_combo.connect("changed", self._protocol_change)
+        self.protocol_handler = self.protocol_combo.connect(
+            "changed", self._protocol_change
+        )
+        self._populate_protocols(self.cache.get("protocols", []))
         self.location_label.set_label("Select location:")
-        self.location_combo.set_property("height-request", 32)
-        for item in get_locations_list():
-            self.location_combo.append_text(item)
-        self.location_combo.set_active(0)
-        self.logo = self.logo.scale_simple(280, 200, GdkPixbuf.InterpType.BILINEAR)
-        self.logo_image = self.logo_image.new_from_pixbuf(self.logo)
+        self.history_label.get_style_context().add_class("dim-label")
+        if catalog.output:
+            self._populate_locations()
         self.protocol_label.set_margin_top(20)
         self._configure_grid()
         self.add(self.grid)
-        last_location = get_settings(SETTINGS) or self.location_combo.get_active_text()
-        self.set_active_item(self.location_combo, last_location)
-        # Update UI
-        self._update_event()
+        self.rendered = None
+        if self.connection.busy:
+            self._connection_changed(self.connection)
+        else:
+            self._update_ui()
+        benchmark_event("window")
+        if BENCHMARK_CONNECT:
+            self.service.connect(BENCHMARK_CONNECT)
+
+        return False
+
+    def _schedule_release(self, _):
+        self._cancel_release()
+        self.release_timer = GLib.timeout_add_seconds(
+            WINDOW_RELEASE_DELAY, self._release_window
+        )
+
+    def _cancel_release(self, _=None):
+        if self.release_timer:
+            GLib.source_remove(self.release_timer)
+            self.release_timer = None
+
+    def _release_window(self):
+        self.release_timer = None
+        if self.get_visible() or not self.grid:
+            return False
+
+        self.remove(self.grid)
+        self.grid.destroy()
+        self.grid = None
+        self.connect_button = None
+        self.fastest_button = None
+        self.location_label = None
+        self.location_picker = None
+        self.history_label = None
+        self.logo_image = None
+        self.protocol_label = None
+        self.protocol_combo = None
+        self.network_lock_combo = None
+        self.network_lock_handler = None
+        self.protocol_handler = None
+
+        return False
+
+    def _tray_ready(self):
+        benchmark_event("tray")
+
+        return False
+
+    def _dump_metrics(self):
+        registry.dump_json(METRICS_DUMP)
+        if self.profiler:
+            self.profiler.write()
+
+        return True
+
+    def _export_metrics(self):
+        registry.write_textfile(PROMETHEUS_TEXTFILE)
+
+        return True
+
+    def _key_press_event(self, _, event):
+        modifiers = Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK
+        if (event.state & modifiers) != modifiers:
+            return False
+        if Gdk.keyval_to_lower(event.keyval) != Gdk.KEY_d:
+            return False
+
+        if self.metrics_window is None:
+            self.metrics_window = MetricsWindow()
+        self.metrics_window.show_all()
+        self.metrics_window.present()
+
+        return True
+
+    def _start_probes(self):
+        self.cache = load_cache(CACHE)
+        if self.cache.get("locations"):
+            catalog.load(self.cache["locations"])
+        if self.cache.get("preferences"):
+            self.updates = {"preferences": self.cache["preferences"]}
+        probes = {
+            "version": get_version,
+            "connection": check_connection,
+            "protocols": get_protocol_list,
+            "locations": catalog.refresh,
+            "status": self.service.refresh,
+        }
+        self.probing = set(probes)
+        for name, probe in probes.items():
+            executor.submit(
+                probe,
+                callback=partial(self._probe_done, name),
+                errback=partial(self._probe_failed, name),
+            )
+
+    def _probe_done(self, name, result):
+        if name == "version":
+            if result != self.cache.get("version"):
+                for probe in self.probing & set(CACHED_PROBES):
+                    self.cache.pop(CACHED_PROBES[probe], None)
+            self.cache["version"] = result
+        elif name == "connection" and not result:
+            self.error_type = "internet_connection_error"
+        elif name == "protocols":
+            self.cache["protocols"] = result
+            self._populate_protocols(result)
+        elif name == "locations":
+            self.cache["locations"] = catalog.output
+            self._populate_locations()
+            self._update_quick_connect()
+        elif name == "status":
+            self.cache["preferences"] = result.get("preferences")
+
+        self.probing.discard(name)
+        if not self.probing and not self.error_type:
+            save_cache(CACHE, self.cache)
+        self._update_ui()
+
+    def _probe_failed(self, name, _):
+        if name == "status":
+            self.error_type = "expressvpn_daemon_error"
+        self.probing.discard(name)
         self._update_ui()
-        self.thread = RepeatingTimer(UPDATE_INTERVAL, self._update_event)
-        self.thread.start()
-        self.update_timer = GLib.timeout_add_seconds(UPDATE_INTERVAL, self._update_ui)
+
+    def _start_polling(self):
+        self.service.set_hidden(not self.get_visible())
+        self.service.start()
+
+    def _restart(self):
+        self.error_type = None
+        self.block_update_ui = False
+        self.rendered = None
+        self._start_probes()
+        self._start_polling()
+
+    def _populate_protocols(self, protocols):
+        if not self.grid:
+            return
+        with self.protocol_combo.handler_block(self.protocol_handler):
+            self.protocol_combo.remove_all()
+            for item in protocols:
+                self.protocol_combo.append(item, item)
+            self.protocol_combo.append(HISTORY_PROTOCOL, "fastest (history)")
+        self.rendered = None
+
+    def _populate_locations(self):
+        if not self.grid:
+            return
+        self.location_picker.populate()
+        if not self.location_picker.get_active():
+            self.location_picker.select(self.settings.location(catalog.by_name))
+        self.rendered = None
 
     def _configure_grid(self):
         self.grid.set_margin_top(40)
@@ -138,140 +522,361 @@ class AppForm(Gtk.Window):
             self.location_label, box, Gtk.PositionType.BOTTOM, 1, 1
         )
         self.grid.attach_next_to(
-            self.location_combo, self.location_label, Gtk.PositionType.BOTTOM, 1, 1
+            self.location_picker, self.location_label, Gtk.PositionType.BOTTOM, 1, 1
+        )
+        self.grid.attach_next_to(
+            self.history_label, self.location_picker, Gtk.PositionType.BOTTOM, 1, 1
+        )
+        self.grid.attach_next_to(
+            self.connect_button, self.history_label, Gtk.PositionType.BOTTOM, 1, 1
         )
         self.grid.attach_next_to(
-            self.connect_button, self.location_combo, Gtk.PositionType.BOTTOM, 1, 1
+            self.fastest_button, self.connect_button, Gtk.PositionType.BOTTOM, 1, 1
         )
 
     def _network_lock_change(self, _):
-        self.block_update_ui = True
-        set_network_lock(self.network_lock_combo.get_active_text())
-        self.block_update_ui = False
-        self._update_event()
+        network_lock = self.network_lock_combo.get_active_text()
+        self.optimistic["network_lock"] = network_lock
+        self.service.set_network_lock(network_lock)
 
     def _protocol_change(self, _):
-        self.block_update_ui = True
-        set_protocol(self.protocol_combo.get_active_text())
-        self.block_update_ui = False
-        self._update_event()
+        protocol = self.protocol_combo.get_active_id()
+        auto_protocol = protocol == HISTORY_PROTOCOL
+        if auto_protocol != self.settings.get("auto_protocol"):
+            self.settings.set("auto_protocol", auto_protocol)
+            self.service.set_auto_protocol(auto_protocol)
+        if auto_protocol:
+            return
+        self.optimistic["preferred_protocol"] = protocol
+        self.service.set_protocol(protocol)
+
+    def _settle_preferences(self, snapshot):
+        preferences = snapshot["preferences"] or {}
+        pending = snapshot.get("pending_preferences") or {}
+        error = snapshot.get("preference_error")
+
+        for key, value in list(self.optimistic.items()):
+            if error and (error["key"], error["value"]) == (key, value):
+                # Roll back to what the daemon reports
+                del self.optimistic[key]
+                window = get_popup("preference_failed")
+                window.message_box(
+                    f"Could not change {PREFERENCE_LABELS[key]} to {value}"
+                )
+                window.show_all()
+            elif key not in pending and preferences.get(key) == value:
+                del self.optimistic[key]
+
+    def _connect_button_event(self, _):
+        self._toggle_connection(self.get_active_location())
+
+    def _connect_fastest_event(self, _):
+        if self.connection.busy or self.updates.get("active_location"):
+            return
+        if self.grid:
+            self.fastest_button.set_sensitive(False)
+        self._set_tray_connect_sensitive(False)
+        self._measure_latency(callback=self._connect_fastest)
+
+    def _connect_fastest(self, ranking):
+        self._show_latency(ranking)
+        if self.connection.busy or self.updates.get("active_location"):
+            return
+        self.service.connect(ranking[0][0] if ranking else catalog.name_for("smart"))
+
+    def _measure_latency(self, callback=None):
+        if self.updates.get("active_location"):
+            if callback:
+                callback(latency.ranking(catalog.locations))
+            return
+        if not callback and not latency.is_stale(catalog.locations):
+            return
+
+        callback = callback or self._show_latency
+        executor.submit(
+            latency.measure,
+            catalog.locations,
+            callback=callback,
+            errback=lambda _: callback([]),
+        )
 
-    def _connect_vpn(self, _, force_location=False):
-        if not force_location:
-            location = self.location_combo.get_active_text()
+    def _show_latency(self, ranking):
+        if self.grid:
+            self.location_picker.show_latency(dict(ranking))
+            self.fastest_button.set_sensitive(not self.updates.get("active_location"))
+        self._set_tray_connect_sensitive(not self.updates.get("active_location"))
+
+    def _show_history(self, location=None):
+        location = location or self.get_active_location()
+        if not location:
+            return
+
+        executor.submit(
+            self.service.history_summary,
+            location,
+            callback=partial(self._history_loaded, location),
+        )
+
+    def _history_loaded(self, location, rows):
+        if self.grid and self.get_active_location() == location:
+            self.history_label.set_text(format_history(location, rows))
+
+    def _location_activated(self, location):
+        if self.connection.busy or self.updates.get("active_location"):
+            return
+        self.service.connect(location)
+
+    def _update_quick_connect(self):
+        known = catalog.by_name
+        favorites = [name for name in self.settings.get("favorites") if name in known]
+        recent = [name for name in self.settings.recent(known) if name not in favorites]
+        location = self.settings.location(known)
+        state = (favorites, recent, location)
+        if state == self.quick_state:
+            return
+        self.quick_state = state
+
+        names = favorites + recent
+        for name in set(self.quick_items) - set(names):
+            self.quick_items.pop(name).destroy()
+        # Entries sit between the fastest item and its separator and the
+        # favorite toggle, existing ones are only moved or relabeled
+        for position, name in enumerate(names, start=2):
+            label = f"\u2605 {name}" if name in favorites else name
+            item = self.quick_items.get(name)
+            if item is None:
+                item = Gtk.MenuItem(label=label)
+                item.connect("activate", self._quick_connect_event, name)
+                item.set_sensitive(self.quick_sensitive)
+                item.show()
+                self.tray_locations_menu.insert(item, position)
+                self.quick_items[name] = item
+            else:
+                if item.get_label() != label:
+                    item.set_label(label)
+                self.tray_locations_menu.reorder_child(item, position)
+        self.tray_quick_separator.set_visible(bool(names))
+        self.tray_favorite.set_visible(bool(location))
+        if location:
+            self.tray_favorite.set_label(f"Favorite: {location}")
+            with self.tray_favorite.handler_block(self.favorite_handler):
+                self.tray_favorite.set_active(location in favorites)
+
+    def _set_tray_connect_sensitive(self, sensitive):
+        self.tray_fastest.set_sensitive(sensitive)
+        self.tray_quick_fastest.set_sensitive(sensitive)
+        if sensitive == self.quick_sensitive:
+            return
+        self.quick_sensitive = sensitive
+        for item in self.quick_items.values():
+            item.set_sensitive(sensitive)
+
+    def _quick_connect_event(self, _, location):
+        self._location_activated(location)
+
+    def _favorite_event(self, _):
+        location = self.settings.location(catalog.by_name)
+        if location:
+            self.settings.toggle_favorite(location)
+            self._update_quick_connect()
+
+    def _prewarm(self):
+        favorites = self.settings.get("favorites")
+        location = self.settings.get("last_location") or (
+            favorites[0] if favorites else None
+        )
+
+        def connect():
+            # Runs next to the startup probes, the status read is shared. The
+            # smart location lookup may have to list locations, so it is
+            # resolved here rather than on the GTK thread
+            target = location or catalog.name_for("smart")
+            if target and not get_status().connected:
+                return self.service.connect(target)
+
+        self.prewarming = True
+        executor.submit(
+            connect,
+            callback=self._prewarm_started,
+            errback=lambda _: self._prewarm_started(False),
+        )
+
+    def _prewarm_started(self, started):
+        self.prewarming = self.prewarming and bool(started)
+
+    def _connect_on_launch_event(self, item):
+        self.settings.set("connect_on_launch", item.get_active())
+
+    def _auto_reconnect_event(self, item):
+        self.settings.set("auto_reconnect", item.get_active())
+        self.service.set_auto_reconnect(item.get_active())
+
+    def _tray_status_event(self, _):
+        self._toggle_connection(self.updates.get("location"))
+
+    def _toggle_connection(self, location):
+        if self.connection.state == CONNECTING:
+            self.service.cancel()
+        elif self.updates.get("active_location"):
+            self.service.disconnect()
         else:
-            location = force_location
-        self.connect_button.set_label("Connecting...")
-        self.connect_button.set_sensitive(False)
-        self.network_lock_combo.set_sensitive(False)
-        self.protocol_combo.set_sensitive(False)
-        self.location_combo.set_sensitive(False)
-        self.grid.queue_draw()
-        self.block_update_ui = True
-        connect_command(get_location_key(location))
-
-        while not self.updates["active_location"]:
-            self._update_gui()
+            self.service.connect(location)
 
-        self.block_update_ui = False
-        self._update_event()
+    def _connection_changed(self, connection):
+        self.rendered = None
+        benchmark_event("connection", state=connection.state)
 
-    def _disconnect_vpn(self, _):
-        self.connect_button.set_label("Disconnecting...")
-        self.connect_button.set_sensitive(False)
-        self.grid.queue_draw()
-        self.block_update_ui = True
-        disconnect_command()
+        if connection.state == CONNECTING:
+            if self.grid:
+                elapsed = int(connection.elapsed)
+                self.connect_button.set_label(f"Connecting... {elapsed}s (Cancel)")
+                self.connect_button.set_sensitive(True)
+                self.network_lock_combo.set_sensitive(False)
+                self.protocol_combo.set_sensitive(False)
+                self.location_picker.set_sensitive(False)
+                self.fastest_button.set_sensitive(False)
+            self._set_tray_connect_sensitive(False)
+            self.tray_status.set_label(f"Cancel - {connection.location}")
+            return
 
-        while self.updates["active_location"]:
-            self._update_gui()
+        if connection.state == DISCONNECTING:
+            if self.grid:
+                self.connect_button.set_label("Disconnecting...")
+                self.connect_button.set_sensitive(False)
+            return
 
-        self.block_update_ui = False
-        self._update_event()
+        if connection.state in (FAILED, TIMED_OUT):
+            reason = "timed out" if connection.state == TIMED_OUT else "failed"
+            window = get_popup("connection_failed")
+            window.message_box(f"Connection to {connection.location} {reason}")
+            window.show_all()
+        elif connection.state == CONNECTED:
+            self.settings.add_recent(connection.location)
+            self._update_quick_connect()
+            if self.prewarming:
+                launch_to_tunnel = time.monotonic() - START_TIME
+                registry.observe_timing("launch_to_tunnel", launch_to_tunnel)
+                benchmark_event("tunnel", seconds=launch_to_tunnel)
+        if not connection.busy:
+            self.prewarming = False
+            self._show_history()
+
+        self._update_ui()
 
     def _update_ui(self):
-        if self.block_update_ui:
-            return True
+        if self.block_update_ui or self.connection.busy:
+            return
 
-        err_type = self.updates.get("error_type")
-        if err_type:
+        if self.error_type:
             self.block_update_ui = True
-            self.block_update_event = True
-            window = get_error_window(err_type, update=True)
+            self.service.stop()
+            window = get_error_window(
+                self.error_type, update=not self.probing, on_activated=self._restart
+            )
             window.show_all()
+            return
 
-        try:
-            if self.connect_handler:
-                self.connect_button.disconnect(self.connect_handler)
-        except RuntimeError:
-            pass
-        try:
-            if self.tray_status_handler:
-                self.tray_status.disconnect(self.tray_status_handler)
-        except RuntimeError:
-            pass
+        view = self._view_state()
+        self._render(view, self.rendered)
+        self.rendered = view
 
+    def _view_state(self):
         active_location = self.updates.get("active_location")
-        preferences = self.updates.get("preferences")
-
-        if preferences:
-            self.set_active_item(self.network_lock_combo, preferences["network_lock"])
-            self.set_active_item(self.protocol_combo, preferences["preferred_protocol"])
-
-        self.connect_button.set_sensitive(True)
+        preferences = dict(self.updates.get("preferences") or {}, **self.optimistic)
+        network_lock = preferences.get("network_lock")
+        protocol = preferences.get("preferred_protocol")
+        if self.settings.get("auto_protocol"):
+            protocol = HISTORY_PROTOCOL
 
         if not active_location:
             location = self.updates.get("location")
-            self.connect_button.set_label("Connect")
-            self.connect_handler = self.connect_button.connect(
-                "clicked", self._connect_vpn
-            )
-            self.network_lock_combo.set_sensitive(True)
-            self.protocol_combo.set_sensitive(True)
-            self.location_combo.set_sensitive(True)
-            self.tray_status.set_label(f"Reconnect - {location}")
-            connect_vpn = partial(self._connect_vpn, force_location=location)
-            self.tray_status_handler = self.tray_status.connect("activate", connect_vpn)
-            self.tray.set_icon_full(ICON, "tray_icon")
-        else:
-            self.connect_button.set_label("Disconnect")
-            self.connect_handler = self.connect_button.connect(
-                "clicked", self._disconnect_vpn
+            return ViewState(
+                connected=False,
+                button_label="Connect",
+                tray_label=f"Reconnect - {location}",
+                icon=(ICON, "tray_icon"),
+                location=None,
+                network_lock=network_lock,
+                protocol=protocol,
             )
-            self.set_active_item(self.location_combo, active_location)
-            self.network_lock_combo.set_sensitive(False)
-            self.protocol_combo.set_sensitive(False)
-            self.location_combo.set_sensitive(False)
-            self.tray_status.set_label(
-                f"Disconnect: {self.location_combo.get_active_text()}"
-            )
-            self.tray_status_handler = self.tray_status.connect(
-                "activate", self._disconnect_vpn
-            )
-            self.tray.set_icon_full(ICON_ACTIVE, "tray_icon_active")
-            set_settings(SETTINGS, self.location_combo.get_active_text())
 
-        self._update_gui()
-        return True
+        return ViewState(
+            connected=True,
+            button_label="Disconnect",
+            tray_label=f"Disconnect: {active_location}",
+            icon=(ICON_ACTIVE, "tray_icon_active"),
+            location=active_location,
+            network_lock=network_lock,
+            protocol=protocol,
+        )
 
-    def _update_event(self):
-        if self.block_update_event:
+    def _render(self, view, rendered):
+        if rendered is None:
+            rendered = ViewState(*[None] * len(ViewState._fields))
+
+        if view.connected != rendered.connected:
+            self._set_tray_connect_sensitive(not view.connected)
+        if view.location and view.location != rendered.location:
+            self.settings.remember_location(view.location)
+            self._update_quick_connect()
+        if view.tray_label != rendered.tray_label:
+            self.tray_status.set_label(view.tray_label)
+        if view.icon != rendered.icon:
+            self.tray.set_icon_full(*view.icon)
+        if not self.grid:
             return
 
-        err_type = check_errors(update=True)
-        if err_type:
-            self.updates["error_type"] = err_type
-            self.thread.cancel()
+        if view.network_lock and view.network_lock != rendered.network_lock:
+            with self.network_lock_combo.handler_block(self.network_lock_handler):
+                self.set_active_item(self.network_lock_combo, view.network_lock)
+        if view.protocol and view.protocol != rendered.protocol:
+            with self.protocol_combo.handler_block(self.protocol_handler):
+                self.protocol_combo.set_active_id(view.protocol)
+        if view.button_label != rendered.button_label:
+            self.connect_button.set_label(view.button_label)
+            self.connect_button.set_sensitive(True)
+        if view.connected != rendered.connected:
+            self.network_lock_combo.set_sensitive(not view.connected)
+            self.protocol_combo.set_sensitive(not view.connected)
+            self.location_picker.set_sensitive(not view.connected)
+            self.fastest_button.set_sensitive(not view.connected)
+        if view.location and view.location != rendered.location:
+            self.location_picker.select(view.location)
+
+    def _service_event(self, snapshot):
+        if self.block_update_ui:
             return
 
-        active_location = get_active_location()
-        preferences = get_preferences_dict()
-        location = get_settings(SETTINGS) or self.location_combo.get_active_text()
+        if snapshot["error"]:
+            self.error_type = snapshot["error"]
+            self._update_ui()
+            return
+
+        auto_reconnect = bool(snapshot.get("auto_reconnect"))
+        if auto_reconnect != self.tray_reconnect.get_active():
+            with self.tray_reconnect.handler_block(self.reconnect_handler):
+                self.tray_reconnect.set_active(auto_reconnect)
+
+        status = snapshot["status"] or {}
         self.updates = {
-            "active_location": active_location,
-            "preferences": preferences,
-            "location": location,
+            "active_location": status.get("location"),
+            "preferences": snapshot["preferences"],
+            "location": self.settings.location(catalog.by_name)
+            or self.get_active_location(),
         }
+        self._settle_preferences(snapshot)
+        previous = self.connection
+        self.connection = ConnectionView(**snapshot["connection"])
+        if self.connection.state != previous.state or self.connection.busy:
+            self._connection_changed(self.connection)
+        else:
+            self._update_ui()
+
+    def get_active_location(self):
+        if not self.grid:
+            return None
+
+        return self.location_picker.get_active()
 
     @staticmethod
     def set_active_item(combobox, name):
@@ -281,27 +886,243 @@ class AppForm(Gtk.Window):
             if row[0] == name:
                 combobox.set_active(i)
 
-    @staticmethod
-    def _update_gui():
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+    def _remember_window(self, _):
+        x, y = self.get_position()
+        self.settings.set("window", {"x": x, "y": y})
 
     def _focus_event(self, _):
+        self._build_window()
+        window = self.settings.get("window")
+        if "x" in window and "y" in window:
+            self.move(window["x"], window["y"])
         self.show_all()
         self.present()
+        self.service.wake()
 
     def _quit_event(self, _):
-        self.block_update_event = True
-        self.thread.cancel()
-        if is_connected():
+        self.service.stop()
+        if self.server:
+            self.server.close()
+        # Decide from known state, a hung daemon must not block quitting
+        if self.connection.state == CONNECTING or self.updates.get("active_location"):
             disconnect_command()
+        self.settings.flush()
+        if self.profiler:
+            self.profiler.write()
         exit()
 
 
+class LocationPicker(Gtk.Box):
+    def __init__(self, on_activate=None, on_select=None):
+        super(LocationPicker, self).__init__(
+            orientation=Gtk.Orientation.VERTICAL, spacing=6
+        )
+        self.on_activate = on_activate
+        self.on_select = on_select
+        self.store = Gtk.TreeStore(str, str, float, bool)
+        self.results = Gtk.ListStore(str, str, float, bool)
+        self.search_entry = Gtk.SearchEntry()
+        self.view = Gtk.TreeView(model=self.store)
+        self.groups = {}
+        self.countries = {}
+        self.country_rows = {}
+        self.rows = {}
+        self.latencies = {}
+        self.configure()
+
+    def configure(self):
+        self.search_entry.set_placeholder_text("Search locations")
+        self.search_entry.connect("search-changed", self._search_event)
+        name_renderer = Gtk.CellRendererText()
+        name_column = Gtk.TreeViewColumn("Location", name_renderer, text=0)
+        name_column.set_expand(True)
+        name_column.set_sort_column_id(0)
+        latency_renderer = Gtk.CellRendererText(xalign=1.0, foreground="gray")
+        latency_column = Gtk.TreeViewColumn("Latency", latency_renderer, text=1)
+        latency_column.set_sort_column_id(2)
+        self.view.append_column(name_column)
+        self.view.append_column(latency_column)
+        self.view.connect("test-expand-row", self._expand_event)
+        self.view.connect("row-activated", self._activate_event)
+        self.view.get_selection().connect("changed", self._select_event)
+        self.store.set_sort_func(2, self._compare_latency)
+        self.store.set_sort_column_id(0, Gtk.SortType.ASCENDING)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scrolled.set_min_content_height(160)
+        scrolled.add(self.view)
+        self.pack_start(self.search_entry, False, False, 0)
+        self.pack_start(scrolled, True, True, 0)
+
+    def populate(self):
+        active_location = self.get_active()
+        self.store.clear()
+        self.groups = catalog.groups()
+        self.countries = {
+            name: country for country, names in self.groups.items() for name in names
+        }
+        self.country_rows = {}
+        self.rows = {}
+
+        for country, names in self.groups.items():
+            value = self._best_latency(names)
+            row = self.store.append(
+                None, [country, self._format_latency(value), value, False]
+            )
+            self.store.append(row, ["", "", float("inf"), False])
+            path = self.store.get_path(row)
+            self.country_rows[country] = Gtk.TreeRowReference.new(self.store, path)
+
+        if active_location:
+            self.select(active_location)
+
+    def get_active(self):
+        model, active = self.view.get_selection().get_selected()
+        if active is None or not model[active][3]:
+            return None
+
+        return model[active][0]
+
+    def select(self, name):
+        if self.view.get_model() is self.results:
+            for row in self.results:
+                if row[0] == name:
+                    self.view.get_selection().select_iter(row.iter)
+                    return
+            self.search_entry.set_text("")
+            self.view.set_model(self.store)
+
+        if name not in self.rows and name in self.countries:
+            self._populate_country(self.countries[name])
+        reference = self.rows.get(name)
+        if reference is None or not reference.valid():
+            return
+
+        path = reference.get_path()
+        self.view.expand_to_path(path)
+        self.view.get_selection().select_path(path)
+        self.view.scroll_to_cell(path, None, False, 0, 0)
+
+    def show_latency(self, latencies):
+        self.latencies = latencies
+
+        for name, reference in self.rows.items():
+            self._set_latency(reference, latencies.get(name, float("inf")))
+        for country, reference in self.country_rows.items():
+            self._set_latency(reference, self._best_latency(self.groups[country]))
+        self.store.set_sort_column_id(2, Gtk.SortType.ASCENDING)
+
+    def _set_latency(self, reference, value):
+        row = self.store.get_iter(reference.get_path())
+        self.store.set(row, [1, 2], [self._format_latency(value), value])
+
+    def _populate_country(self, country):
+        reference = self.country_rows[country]
+        parent = self.store.get_iter(reference.get_path())
+        placeholder = self.store.iter_children(parent)
+        if placeholder is None or self.store[placeholder][3]:
+            return
+
+        for name in self.groups[country]:
+            value = self.latencies.get(name, float("inf"))
+            row = self.store.append(
+                parent, [name, self._format_latency(value), value, True]
+            )
+            path = self.store.get_path(row)
+            self.rows[name] = Gtk.TreeRowReference.new(self.store, path)
+        self.store.remove(placeholder)
+
+    def _search_event(self, entry):
+        text = entry.get_text().strip()
+        if not text:
+            self.view.set_model(self.store)
+            return
+
+        self.results.clear()
+        matches = sorted(
+            catalog.search(text),
+            key=lambda name: (self.latencies.get(name, float("inf")), name),
+        )
+        for name in matches:
+            value = self.latencies.get(name, float("inf"))
+            self.results.append([name, self._format_latency(value), value, True])
+        self.view.set_model(self.results)
+        if len(self.results):
+            self.view.get_selection().select_path(Gtk.TreePath.new_first())
+
+    def _expand_event(self, view, parent, path):
+        country = self.store[parent][0]
+        if country in self.country_rows:
+            self._populate_country(country)
+
+        return False
+
+    def _activate_event(self, view, path, column):
+        model = view.get_model()
+        if model[path][3] and self.on_activate:
+            self.on_activate(model[path][0])
+
+    def _select_event(self, _):
+        location = self.get_active()
+        if location and self.on_select:
+            self.on_select(location)
+
+    def _best_latency(self, names):
+        return min(
+            (self.latencies.get(name, float("inf")) for name in names),
+            default=float("inf"),
+        )
+
+    @staticmethod
+    def _format_latency(value):
+        return f"{value * 1000:.0f} ms" if value != float("inf") else ""
+
+    @staticmethod
+    def _compare_latency(model, a, b, _):
+        first = (model[a][2], model[a][0])
+        second = (model[b][2], model[b][0])
+
+        return (first > second) - (first < second)
+
+
+class MetricsWindow(Gtk.Window):
+    def __init__(self):
+        super(Gtk.Window, self).__init__(title=f"{TITLE} - Metrics")
+        self.text_view = Gtk.TextView(editable=False, monospace=True)
+        self.refresh_timer = None
+        self._configure()
+
+    def _configure(self):
+        self.set_default_size(560, 360)
+        self.set_icon_from_file(ICON)
+        self.connect("delete-event", lambda w, e: w.hide() or True)
+        self.connect("show", self._show_event)
+        self.connect("hide", self._hide_event)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(self.text_view)
+        self.add(scrolled)
+
+    def _refresh(self):
+        self.text_view.get_buffer().set_text(registry.format_text())
+
+        return True
+
+    def _show_event(self, _):
+        self._refresh()
+        if self.refresh_timer is None:
+            self.refresh_timer = GLib.timeout_add_seconds(1, self._refresh)
+
+    def _hide_event(self, _):
+        if self.refresh_timer is not None:
+            GLib.source_remove(self.refresh_timer)
+            self.refresh_timer = None
+
+
 class PopUpWindow(Gtk.Window):
     def __init__(self, action="close"):
         super(Gtk.Window, self).__init__(title=TITLE)
         self.action = action
+        self.message_text = None
         self._configure()
 
     def _configure(self):
@@ -311,6 +1132,10 @@ class PopUpWindow(Gtk.Window):
         self.connect("delete-event", self._close_event)
 
     def message_box(self, text):
+        if self.message_text:
+            self.message_text.set_label(text)
+            return
+
         layout = Gtk.Grid(
             orientation=Gtk.Orientation.VERTICAL,
             column_spacing=30,
@@ -338,20 +1163,37 @@ class PopUpWindow(Gtk.Window):
             button_layout, message_text, Gtk.PositionType.BOTTOM, 1, 1
         )
         self.add(layout)
+        self.message_text = message_text
 
-    def activation_box(self):
-        def on_ok(_):
-            code = activation_code.get_text() or "N/A"
+    def activation_box(self, on_activated=None):
+        if self.get_child():
+            return
+
+        def activate(code):
             activate_command(code)
-            if not is_activated():
-                activation_popup = PopUpWindow(action="close")
+            return is_activated()
+
+        def activation_done(activated):
+            ok_button.set_sensitive(True)
+            if not activated:
+                activation_popup = get_popup("activation_failed")
                 activation_popup.message_box("Invalid activation code!")
                 activation_popup.show_all()
                 return
             else:
-                AppForm()
+                (on_activated or AppForm)()
                 self.hide()
 
+        def on_ok(_):
+            code = activation_code.get_text() or "N/A"
+            ok_button.set_sensitive(False)
+            executor.submit(
+                activate,
+                code,
+                callback=activation_done,
+                errback=lambda _: activation_done(False),
+            )
+
         layout = Gtk.Grid(
             orientation=Gtk.Orientation.VERTICAL,
             column_spacing=25,
@@ -391,57 +1233,66 @@ class PopUpWindow(Gtk.Window):
 
     def _close_event(self, *args):
         if self.action == "close":
+            # Popups are reused, keep GTK from destroying this one
             self.hide()
+            return True
         elif self.action == "quit":
-            if is_connected():
+            try:
+                connected = is_connected()
+            except TimeoutExpired:
+                connected = False
+            if connected:
                 disconnect_command()
             exit()
 
 
-def check_errors(update=False):
-    if not check_connection() and not update:
-        return "internet_connection_error"
-    if not check_expressvpn():
-        return "expressvpn_error"
-    if not check_daemon():
-        return "expressvpn_daemon_error"
-    if not is_activated():
-        return "expressvpn_activation_error"
+_popups = {}
 
 
-def get_error_window(error, update=False):
+def get_popup(key, action="close"):
+    window = _popups.get(key)
+    if window is None:
+        window = _popups[key] = PopUpWindow(action=action)
+
+    return window
+
+
+def get_error_window(error, update=False, on_activated=None):
     if error == "internet_connection_error":
-        window = PopUpWindow(action="quit")
+        window = get_popup(error, action="quit")
         window.message_box("Please check your internet connection")
         return window
 
     if error == "expressvpn_error":
-        window = PopUpWindow(action="quit")
+        window = get_popup(error, action="quit")
         window.message_box("Please install expressvpn in order to use GUI")
         return window
 
     if error == "expressvpn_daemon_error":
-        window = PopUpWindow(action="quit")
+        window = get_popup(error, action="quit")
         window.message_box("Please make sure that expressvpn daemon is running")
         return window
 
     if error == "expressvpn_activation_error":
         if not update:
-            window = PopUpWindow(action="quit")
-            window.activation_box()
+            window = get_popup(error, action="quit")
+            window.activation_box(on_activated)
         else:
-            window = PopUpWindow(action="quit")
+            window = get_popup(f"{error}_update", action="quit")
             window.message_box("Please restart the GUI in order to activate expressvpn")
         return window
 
 
-if __name__ == "__main__":
-    error_type = check_errors()
+def _main_loop_dispatch(function, *args):
+    def run():
+        function(*args)
+        return False
 
-    if error_type:
-        error_window = get_error_window(error_type)
-        error_window.show_all()
-    else:
-        AppForm()
+    GLib.idle_add(run)
+
+
+if __name__ == "__main__":
+    executor.dispatch = _main_loop_dispatch
+    AppForm()
 
     Gtk.main()
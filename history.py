@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from collections import deque
+from threading import Lock
+
+from utils import (
+    CONNECTED,
+    CONNECTING,
+    DISCONNECTED,
+    DISCONNECTING,
+    FAILED,
+    TIMED_OUT,
+)
+
+HISTORY_LIMIT = 50
+MIN_SAMPLES = 3
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class ConnectHistory:
+    def __init__(self, path=None, limit=HISTORY_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.connects = {}
+        self.sessions = {}
+        self.lines = 0
+        self.state = None
+        self.pending = None
+        self.session = None
+        self.lock = Lock()
+        self.load()
+
+    def load(self):
+        if not self.path:
+            return
+
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    self.lines += 1
+        except OSError:
+            pass
+
+    def observe(self, snapshot):
+        connection = snapshot["connection"]
+        state = connection["state"]
+        location = connection["location"]
+        protocol = (snapshot["preferences"] or {}).get("preferred_protocol")
+        now = time.monotonic()
+
+        with self.lock:
+            previous, self.state = self.state, state
+            if state == CONNECTING and previous != CONNECTING:
+                self._end_session(now)
+                self.pending = (location, now)
+            elif state == CONNECTED:
+                if self.session and self.session[3] == location:
+                    return
+                self._end_session(now)
+                key = location
+                if self.pending:
+                    # Key by what was asked for, smart locations resolve to
+                    # another name once connected
+                    key, started = self.pending
+                    self._record("connect", key, protocol, now - started)
+                self.pending = None
+                self.session = (key, protocol, now, location)
+            elif state in (FAILED, TIMED_OUT) and self.pending:
+                location, started = self.pending
+                self._record("failure", location, protocol, now - started)
+                self.pending = None
+            elif state in (DISCONNECTING, DISCONNECTED):
+                self._end_session(now)
+                self.pending = None
+
+    def summary(self, location=None):
+        with self.lock:
+            keys = sorted(set(self.connects) | set(self.sessions))
+            rows = []
+            for key in keys:
+                if location and key[0] != location:
+                    continue
+                attempts = list(self.connects.get(key, ()))
+                times = [seconds for seconds in attempts if seconds is not None]
+                sessions = list(self.sessions.get(key, ()))
+                rows.append(
+                    {
+                        "location": key[0],
+                        "protocol": key[1],
+                        "attempts": len(attempts),
+                        "failures": len(attempts) - len(times),
+                        "p50": percentile(times, 50),
+                        "p90": percentile(times, 90),
+                        "session_p50": percentile(sessions, 50),
+                    }
+                )
+
+        return rows
+
+    def fastest(self, location, min_samples=MIN_SAMPLES):
+        best = None
+        for row in self.summary(location):
+            successes = row["attempts"] - row["failures"]
+            if successes < min_samples:
+                continue
+            # Expected time to a tunnel when failed attempts are retried
+            score = row["p50"] * row["attempts"] / successes
+            if best is None or score < best[0]:
+                best = (score, row["protocol"])
+
+        return best[1] if best else None
+
+    def _end_session(self, now):
+        session, self.session = self.session, None
+        if session:
+            location, protocol, started, _ = session
+            self._record("session", location, protocol, now - started)
+
+    def _record(self, kind, location, protocol, seconds):
+        entry = {
+            "kind": kind,
+            "location": location,
+            "protocol": protocol,
+            "seconds": round(seconds, 3),
+            "time": time.time(),
+        }
+        self._add(entry)
+        self._append(entry)
+
+    def _add(self, entry):
+        key = (entry["location"], entry["protocol"])
+        kind = entry["kind"]
+        if kind == "session":
+            buffer = self.sessions
+            value = entry["seconds"]
+        else:
+            buffer = self.connects
+            value = entry["seconds"] if kind == "connect" else None
+        if key not in buffer:
+            buffer[key] = deque(maxlen=self.limit)
+        buffer[key].append(value)
+
+    def _append(self, entry):
+        if not self.path:
+            return
+
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.lines += 1
+            if self.lines > 2 * self._size() + self.limit:
+                self._compact()
+        except OSError:
+            pass
+
+    def _size(self):
+        return sum(len(d) for d in self.connects.values()) + sum(
+            len(d) for d in self.sessions.values()
+        )
+
+    def _compact(self):
+        # Rewrite the log with only what the ring buffers still hold, bad
+        # lines are dropped the same way load() skips them
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        kept = []
+        remaining = {}
+        for entry in reversed(entries):
+            try:
+                key = (entry["location"], entry["protocol"], entry["kind"] == "session")
+                left = remaining.setdefault(key, self.limit)
+            except (KeyError, TypeError):
+                continue
+            if left > 0:
+                remaining[key] -= 1
+                kept.append(entry)
+        kept.reverse()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            for entry in kept:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temporary, self.path)
+        self.lines = len(kept)
@@ -0,0 +1,229 @@
+import json
+import os
+import subprocess
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+from functools import wraps
+from threading import Lock
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "expressvpn_gui_command"
+TIMING_PREFIX = "expressvpn_gui"
+
+
+class CommandMetrics:
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.exit_codes = {}
+
+    def observe(self, duration, exit_code=0, timed_out=False):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.buckets[bisect_left(BUCKETS, duration)] += 1
+        if timed_out:
+            self.timeouts += 1
+        elif exit_code != 0:
+            self.failures += 1
+        if not timed_out:
+            self.exit_codes[exit_code] = self.exit_codes.get(exit_code, 0) + 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0,
+            "max_seconds": self.max,
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.buckets)),
+            "exit_codes": {str(code): n for code, n in self.exit_codes.items()},
+        }
+
+
+def _histogram(metric, label, snapshot):
+    lines = []
+
+    for name, data in snapshot.items():
+        cumulative = 0
+        for bound, count in data["buckets"].items():
+            cumulative += count
+            lines.append(
+                f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{metric}_sum{{{label}="{name}"}} {data["total_seconds"]}')
+        lines.append(f'{metric}_count{{{label}="{name}"}} {data["count"]}')
+
+    return lines
+
+
+def _exit_code(error):
+    if isinstance(error, subprocess.CalledProcessError):
+        return error.returncode
+
+    return -1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.commands = {}
+        self.counters = {}
+        self.timings = {}
+        self.lock = Lock()
+
+    def observe(self, name, duration, exit_code=0, timed_out=False):
+        with self.lock:
+            metrics = self.commands.setdefault(name, CommandMetrics())
+            metrics.observe(duration, exit_code, timed_out)
+
+    def observe_timing(self, name, duration):
+        with self.lock:
+            metrics = self.timings.setdefault(name, CommandMetrics())
+            metrics.observe(duration)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_error(self, name, duration, error):
+        if isinstance(error, subprocess.TimeoutExpired):
+            self.observe(name, duration, timed_out=True)
+        else:
+            self.observe(name, duration, exit_code=_exit_code(error))
+
+    def timed(self, name):
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.monotonic()
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as error:
+                    self.observe_error(name, time.monotonic() - started, error)
+                    raise
+
+                if isinstance(result, Future):
+                    result.add_done_callback(
+                        lambda future: self._observe_future(name, started, future)
+                    )
+                else:
+                    self.observe(name, time.monotonic() - started)
+
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def _observe_future(self, name, started, future):
+        duration = time.monotonic() - started
+        error = None if future.cancelled() else future.exception()
+        if error is None:
+            self.observe(name, duration)
+        else:
+            self.observe_error(name, duration, error)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: m.as_dict() for name, m in sorted(self.commands.items())}
+
+    def timing_snapshot(self):
+        with self.lock:
+            return {name: m.as_dict() for name, m in sorted(self.timings.items())}
+
+    def counter_snapshot(self):
+        with self.lock:
+            return dict(sorted(self.counters.items()))
+
+    def format_text(self):
+        lines = [
+            f"{'command':<28} {'count':>6} {'fail':>5} {'tmo':>4} {'mean':>8} {'max':>8}"
+        ]
+
+        for name, data in self.snapshot().items():
+            lines.append(
+                f"{name:<28} {data['count']:>6} {data['failures']:>5} "
+                f"{data['timeouts']:>4} {data['mean_seconds'] * 1000:>6.0f}ms "
+                f"{data['max_seconds'] * 1000:>6.0f}ms"
+            )
+
+        for name, data in self.timing_snapshot().items():
+            lines.append(
+                f"{name:<28} {data['count']:>6} {'':>5} {'':>4} "
+                f"{data['mean_seconds'] * 1000:>6.0f}ms "
+                f"{data['max_seconds'] * 1000:>6.0f}ms"
+            )
+
+        for name, value in self.counter_snapshot().items():
+            lines.append(f"{name:<28} {value:>6}")
+
+        return "\n".join(lines)
+
+    def prometheus(self):
+        lines = [
+            f"# HELP {PREFIX}_duration_seconds Wall time of expressvpn CLI calls.",
+            f"# TYPE {PREFIX}_duration_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        lines.extend(_histogram(f"{PREFIX}_duration_seconds", "command", snapshot))
+
+        for metric, key in (("failures", "failures"), ("timeouts", "timeouts")):
+            lines.append(f"# TYPE {PREFIX}_{metric}_total counter")
+            for name, data in snapshot.items():
+                lines.append(f'{PREFIX}_{metric}_total{{command="{name}"}} {data[key]}')
+
+        lines.append(f"# TYPE {PREFIX}_exits_total counter")
+        for name, data in snapshot.items():
+            for code, count in data["exit_codes"].items():
+                lines.append(
+                    f'{PREFIX}_exits_total{{command="{name}",code="{code}"}} {count}'
+                )
+
+        lines.extend(
+            [
+                f"# HELP {TIMING_PREFIX}_duration_seconds Wall time of GUI and "
+                "poller events.",
+                f"# TYPE {TIMING_PREFIX}_duration_seconds histogram",
+            ]
+        )
+        lines.extend(
+            _histogram(
+                f"{TIMING_PREFIX}_duration_seconds", "event", self.timing_snapshot()
+            )
+        )
+
+        for name, value in self.counter_snapshot().items():
+            lines.append(f"# TYPE expressvpn_gui_{name}_total counter")
+            lines.append(f"expressvpn_gui_{name}_total {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path):
+        content = {
+            "commands": self.snapshot(),
+            "timings": self.timing_snapshot(),
+            "counters": self.counter_snapshot(),
+        }
+        self._write(path, json.dumps(content, indent=2))
+
+    def write_textfile(self, path):
+        self._write(path, self.prometheus())
+
+    @staticmethod
+    def _write(path, content):
+        temp_file = f"{path}.tmp"
+        try:
+            with open(temp_file, "w") as f:
+                f.write(content)
+            os.replace(temp_file, path)
+        except OSError:
+            pass
+
+
+registry = MetricsRegistry()
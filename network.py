@@ -0,0 +1,220 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from threading import Lock
+
+from metrics import registry
+
+PROBE_TARGETS = [("1.1.1.1", 443), ("8.8.8.8", 53), ("google.com", 443)]
+PROBE_TIMEOUT = 2
+PROBE_TTL = 30
+OFFLINE_HINTS = ("network is unreachable", "no internet", "unable to connect")
+
+
+def _parse_targets(value):
+    targets = []
+
+    for item in value.split(","):
+        host, _, port = item.strip().rpartition(":")
+        if host and port.isdigit():
+            targets.append((host, int(port)))
+
+    return targets
+
+
+def _targets_from_environment():
+    value = os.environ.get("EXPRESSVPN_GUI_PROBE_TARGETS")
+
+    return _parse_targets(value) if value else PROBE_TARGETS
+
+
+def tcp_probe(target, timeout=PROBE_TIMEOUT):
+    # Resolve first so only the handshake is timed, a slow resolver would
+    # otherwise decide the latency ranking
+    family, kind, protocol, _, address = socket.getaddrinfo(
+        *target, type=socket.SOCK_STREAM
+    )[0]
+    with socket.socket(family, kind, protocol) as sock:
+        sock.settimeout(timeout)
+        started = time.monotonic()
+        sock.connect(address)
+
+        return time.monotonic() - started
+
+
+class Reachability:
+    def __init__(
+        self, targets=None, timeout=PROBE_TIMEOUT, ttl=PROBE_TTL, passive=None
+    ):
+        self.targets = targets or _targets_from_environment()
+        self.timeout = timeout
+        self.ttl = ttl
+        if passive is None:
+            passive = os.environ.get("EXPRESSVPN_GUI_PROBE_MODE") == "passive"
+        self.passive = passive
+        self.result = None
+        self.checked_at = None
+        self.lock = Lock()
+        self.pool = ThreadPoolExecutor(
+            max_workers=len(self.targets) or 1, thread_name_prefix="reachability"
+        )
+
+    def check(self, status=None):
+        if self.passive:
+            return self._from_status(status)
+
+        with self.lock:
+            checked_at = self.checked_at
+            if checked_at is not None and time.monotonic() - checked_at < self.ttl:
+                return self.result
+            self.result = self._probe()
+            self.checked_at = time.monotonic()
+
+            return self.result
+
+    def invalidate(self):
+        with self.lock:
+            self.checked_at = None
+
+    def _probe(self):
+        futures = [
+            self.pool.submit(tcp_probe, target, self.timeout) for target in self.targets
+        ]
+        try:
+            for future in as_completed(futures, timeout=self.timeout):
+                if future.exception() is None:
+                    return True
+        except TimeoutError:
+            pass
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return False
+
+    @staticmethod
+    def _from_status(status):
+        if status is None or status.connected:
+            return True
+        message = status.message.lower()
+
+        return not any(hint in message for hint in OFFLINE_HINTS)
+
+
+reachability = Reachability()
+
+
+LATENCY_TTL = 10 * 60
+LATENCY_CONCURRENCY = 16
+LATENCY_PORT = 443
+# The CLI does not expose server addresses, so there is nothing to probe
+# unless the user provides a host template
+LATENCY_HOST = os.environ.get("EXPRESSVPN_GUI_LATENCY_HOST")
+
+
+def location_target(location):
+    return (LATENCY_HOST.format(key=location.key), LATENCY_PORT)
+
+
+class LatencyRanker:
+    def __init__(
+        self,
+        target=None,
+        probe=tcp_probe,
+        concurrency=LATENCY_CONCURRENCY,
+        ttl=LATENCY_TTL,
+        timeout=PROBE_TIMEOUT,
+    ):
+        if target is None and LATENCY_HOST:
+            target = location_target
+        self.target = target
+        self.probe = probe
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.timeout = timeout
+        self.results = {}
+        self.lock = Lock()
+
+    def latency(self, name):
+        result = self.results.get(name)
+        if result is None or time.monotonic() - result[1] > self.ttl:
+            return None
+
+        return result[0]
+
+    @property
+    def enabled(self):
+        return self.target is not None
+
+    def is_stale(self, locations):
+        if not self.enabled:
+            return False
+
+        return any(
+            location.name not in self.results
+            or time.monotonic() - self.results[location.name][1] > self.ttl
+            for location in locations
+            if location.key != "smart"
+        )
+
+    def measure(self, locations):
+        if not self.enabled:
+            return []
+
+        now = time.monotonic()
+        pending = {
+            location.name: location
+            for location in locations
+            if location.key != "smart"
+            and (
+                location.name not in self.results
+                or now - self.results[location.name][1] > self.ttl
+            )
+        }
+
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="latency"
+        ) as pool:
+            futures = {
+                pool.submit(self._measure, location): name
+                for name, location in pending.items()
+            }
+            for future in as_completed(futures):
+                with self.lock:
+                    self.results[futures[future]] = (
+                        future.result(),
+                        time.monotonic(),
+                    )
+
+        return self.ranking(locations)
+
+    def ranking(self, locations=None):
+        names = (
+            {location.name for location in locations}
+            if locations is not None
+            else set(self.results)
+        )
+        ranking = []
+
+        for name in names:
+            value = self.latency(name)
+            if value is not None:
+                ranking.append((name, value))
+
+        return sorted(ranking, key=lambda item: (item[1], item[0]))
+
+    def fastest(self, locations=None):
+        ranking = self.ranking(locations)
+
+        return ranking[0][0] if ranking else None
+
+    def _measure(self, location):
+        try:
+            return self.probe(self.target(location), self.timeout)
+        except OSError:
+            registry.increment("latency_probe_failures")
+            return None
+
+
+latency = LatencyRanker()
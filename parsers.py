@@ -0,0 +1,118 @@
+import re
+from collections import namedtuple
+
+Location = namedtuple("Location", ["key", "name", "country", "recommended"])
+
+StatusSnapshot = namedtuple(
+    "StatusSnapshot",
+    ["daemon_running", "activated", "connected", "location", "message"],
+)
+
+_alias = re.compile(r"^[a-z0-9]+$")
+_ansi_escape = re.compile(r"(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]")
+_column_separator = re.compile(r"\t+|\s{2,}")
+_country_break = re.compile(r"^(.*\)) (.+)$")
+_update_notice = re.compile(r"^A new version is available", re.IGNORECASE)
+_version = re.compile(r"expressvpn version (\S+)")
+
+
+def escape_ansi(output):
+    return _ansi_escape.sub("", output)
+
+
+def _lines(output):
+    for line in escape_ansi(output).splitlines():
+        line = line.strip()
+        if line:
+            yield line
+
+
+def parse_status(output):
+    location = None
+    message = ""
+    activated = True
+
+    for line in _lines(output):
+        if not message and not _update_notice.match(line):
+            message = line
+        if line.startswith("Connected to "):
+            location = line[len("Connected to ") :]
+        elif "Not Activated" in line:
+            activated = False
+
+    return StatusSnapshot(
+        daemon_running=True,
+        activated=activated,
+        connected=location is not None,
+        location=location,
+        message=message,
+    )
+
+
+def parse_location_row(line):
+    fields = [field for field in _column_separator.split(line.strip()) if field]
+    key, *rest = fields[0].split(None, 1)
+    if not _alias.match(key):
+        return None
+    fields = rest + fields[1:]
+    recommended = bool(fields) and fields[-1] == "Y"
+    if recommended:
+        fields.pop()
+    if not fields:
+        return None
+
+    country = fields[0] if len(fields) > 1 else None
+    country_break = _country_break.match(fields[-1])
+    if country_break:
+        country = country or country_break.group(1)
+        name = country_break.group(2)
+    else:
+        name = fields[-1]
+
+    return Location(key, name, country, recommended)
+
+
+def parse_locations(output):
+    locations = []
+    started = False
+    country = None
+
+    for line in _lines(output):
+        if not started:
+            started = line.startswith("smart") or line.startswith("-")
+            if not line.startswith("smart"):
+                continue
+        location = parse_location_row(line)
+        if not location:
+            continue
+        if location.key == "smart":
+            pass
+        elif location.country:
+            country = location.country
+        else:
+            location = location._replace(country=country)
+        locations.append(location)
+
+    return locations
+
+
+def parse_preferences(output):
+    preferences = {}
+
+    for line in _lines(output):
+        key, _, value = line.partition("\t")
+        if not value:
+            key, _, value = line.partition(" ")
+        preferences[key.strip()] = value.strip()
+
+    return preferences
+
+
+def parse_protocols(output):
+    return list(_lines(output))
+
+
+def parse_version(output):
+    version = _version.search(escape_ansi(output))
+
+    return version.group(1) if version else None
@@ -0,0 +1,163 @@
+import json
+import random
+import time
+from collections import deque
+from threading import Lock, Timer
+
+from network import latency
+from utils import (
+    CONNECTED,
+    DISCONNECTED,
+    DISCONNECTING,
+    FAILED,
+    TIMED_OUT,
+    catalog,
+)
+
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+RECONNECT_JITTER = 0.3
+FAILOVER_AFTER = 3
+OUTAGE_LIMIT = 100
+
+
+class ReconnectWatchdog:
+    def __init__(
+        self,
+        service,
+        enabled=False,
+        log_file=None,
+        base_delay=RECONNECT_BASE_DELAY,
+        max_delay=RECONNECT_MAX_DELAY,
+        jitter=RECONNECT_JITTER,
+        failover_after=FAILOVER_AFTER,
+    ):
+        self.service = service
+        self.enabled = enabled
+        self.log_file = log_file
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.failover_after = failover_after
+        self.state = None
+        self.location = None
+        self.outage = None
+        self.timer = None
+        self.recoveries = {}
+        self.outages = deque(maxlen=OUTAGE_LIMIT)
+        self.lock = Lock()
+
+    def set_enabled(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            if not enabled:
+                self._end_outage(None)
+
+    def observe(self, snapshot):
+        connection = snapshot["connection"]
+        state = connection["state"]
+
+        with self.lock:
+            previous = self.state
+            self.state = state
+            if state == CONNECTED:
+                if self.outage:
+                    self._end_outage(connection["location"])
+                self.location = connection["location"]
+            elif state == DISCONNECTING:
+                # The user asked for it, this is not an outage
+                self._end_outage(None)
+            elif state == DISCONNECTED and previous == CONNECTED and self.enabled:
+                self._start_outage()
+            elif state in (FAILED, TIMED_OUT) and previous != state and self.outage:
+                self.outage["failures"] += 1
+                self.outage["failed"].add(self.outage["target"])
+                self._schedule()
+
+    def _start_outage(self):
+        self.outage = {
+            "location": self.location,
+            "target": self.location,
+            "started": time.time(),
+            "started_at": time.monotonic(),
+            "failures": 0,
+            "attempts": 0,
+            "failed": set(),
+        }
+        self._schedule()
+
+    def _end_outage(self, location):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        outage, self.outage = self.outage, None
+        if not outage:
+            return
+
+        record = {
+            "location": outage["location"],
+            "started": outage["started"],
+            "duration": time.monotonic() - outage["started_at"],
+            "attempts": outage["attempts"],
+            "recovered": location is not None,
+            "recovered_location": location,
+        }
+        if location:
+            self.recoveries[location] = self.recoveries.get(location, 0) + 1
+        self.outages.append(record)
+        self._log(record)
+
+    def _schedule(self):
+        failures = self.outage["failures"]
+        delay = min(self.base_delay * 2**failures, self.max_delay)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        if self.timer:
+            self.timer.cancel()
+        self.timer = Timer(delay, self._attempt)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _attempt(self):
+        with self.lock:
+            outage = self.outage
+            if not outage or not self.enabled:
+                return
+            failover = outage["failures"] >= self.failover_after
+
+        target = self._failover(outage) if failover else outage["target"]
+        with self.lock:
+            if self.outage is not outage:
+                return
+            outage["target"] = target
+            outage["attempts"] += 1
+
+        if not self.service.connect(target):
+            with self.lock:
+                if self.outage is outage:
+                    self._schedule()
+
+    def _failover(self, outage):
+        failed = outage["failed"]
+        if latency.is_stale(catalog.locations):
+            latency.measure(catalog.locations)
+        ranking = [
+            (name, rtt)
+            for name, rtt in latency.ranking(catalog.locations)
+            if name not in failed
+        ]
+        # Prefer locations that recovered before, then the lowest latency
+        ranking.sort(key=lambda entry: (-self.recoveries.get(entry[0], 0), entry[1]))
+        if ranking:
+            return ranking[0][0]
+
+        return catalog.name_for("smart", outage["location"])
+
+    def _log(self, record):
+        if not self.log_file:
+            return
+
+        try:
+            with open(self.log_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass
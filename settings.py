@@ -0,0 +1,142 @@
+import atexit
+import json
+import os
+import time
+from copy import deepcopy
+from threading import Lock, Timer
+
+SAVE_DELAY = 2
+RECENT_LIMIT = 10
+DEFAULTS = {
+    "last_location": None,
+    "favorites": [],
+    "recent": [],
+    "window": {},
+    "auto_reconnect": False,
+    "connect_on_launch": False,
+    "auto_protocol": False,
+}
+
+
+class SettingsStore:
+    def __init__(self, path, legacy_path=None, delay=SAVE_DELAY):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.delay = delay
+        self.data = deepcopy(DEFAULTS)
+        self.dirty = False
+        self.timer = None
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.load()
+        # The save timer is a daemon thread, catch every way out
+        atexit.register(self.flush)
+
+    def load(self):
+        migrated = False
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = self._migrate()
+            migrated = data is not None
+
+        with self.lock:
+            self.data = deepcopy(DEFAULTS)
+            if isinstance(data, dict):
+                self.data.update({k: v for k, v in data.items() if k in DEFAULTS})
+            self.dirty = migrated
+        if migrated:
+            self._schedule()
+
+    def _migrate(self):
+        if not self.legacy_path:
+            return None
+
+        try:
+            with open(self.legacy_path, "r") as f:
+                location = f.readline().strip()
+        except OSError:
+            return None
+
+        return {"last_location": location or None}
+
+    def get(self, key):
+        with self.lock:
+            return deepcopy(self.data[key])
+
+    def set(self, key, value):
+        with self.lock:
+            if self.data[key] == value:
+                return False
+            self.data[key] = deepcopy(value)
+            self.dirty = True
+        self._schedule()
+
+        return True
+
+    def location(self, known):
+        location = self.get("last_location")
+
+        return location if location in known else None
+
+    def remember_location(self, location):
+        self.set("last_location", location)
+
+    def add_recent(self, location):
+        recent = [entry for entry in self.get("recent") if entry[0] != location]
+        recent.insert(0, [location, time.time()])
+        self.set("recent", recent[:RECENT_LIMIT])
+
+    def recent(self, known=None):
+        return [
+            location
+            for location, _ in self.get("recent")
+            if known is None or location in known
+        ]
+
+    def is_favorite(self, location):
+        return location in self.get("favorites")
+
+    def toggle_favorite(self, location):
+        favorites = self.get("favorites")
+        if location in favorites:
+            favorites.remove(location)
+        else:
+            favorites.append(location)
+        self.set("favorites", favorites)
+
+        return location in favorites
+
+    def _schedule(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        # Serialized so a timer flush and a quit flush cannot interleave on
+        # the temporary file or land out of order
+        with self.write_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            content = json.dumps(self.data, indent=2)
+            self.dirty = False
+
+        temp_file = f"{self.path}.tmp"
+        try:
+            with open(temp_file, "w") as f:
+                f.write(content)
+            os.replace(temp_file, self.path)
+        except OSError:
+            with self.lock:
+                self.dirty = True
@@ -1,231 +1,682 @@
+import json
 import os
 import re
 import subprocess
-import http.client as httplib
-from threading import Event, Timer
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from threading import Event, Lock, Thread, Timer
 
 import pexpect
 
-
-class RepeatingTimer(Timer):
-    def __init__(self, interval, function, *args, **kwargs):
-        super(RepeatingTimer, self).__init__(interval, function, *args, **kwargs)
-        self.args = args
-        self.kwargs = kwargs
+from metrics import registry
+from network import reachability
+from parsers import (
+    StatusSnapshot,
+    parse_locations,
+    parse_preferences,
+    parse_protocols,
+    parse_status,
+    parse_version,
+)
+
+POLL_FAST_INTERVAL = 0.5
+POLL_MIN_INTERVAL = 2
+POLL_MAX_INTERVAL = 30
+POLL_HIDDEN_INTERVAL = 60
+
+
+class PollingScheduler(Thread):
+    def __init__(
+        self,
+        function,
+        fast_interval=POLL_FAST_INTERVAL,
+        min_interval=POLL_MIN_INTERVAL,
+        max_interval=POLL_MAX_INTERVAL,
+        hidden_interval=POLL_HIDDEN_INTERVAL,
+    ):
+        super(PollingScheduler, self).__init__(daemon=True)
         self.function = function
-        self.interval = interval
+        self.fast_interval = fast_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.hidden_interval = hidden_interval
+        self.interval = min_interval
+        self.hidden = False
+        self.transition = False
         self.finished = Event()
+        self.wakeup = Event()
+        self.next_run = None
+        self.overruns = 0
 
     def run(self):
+        self.next_run = time.monotonic() + self.next_interval()
         while not self.finished.is_set():
-            self.finished.wait(self.interval)
-            self.function(*self.args, **self.kwargs)
-
+            self.wakeup.wait(max(self.next_run - time.monotonic(), 0))
+            if self.finished.is_set():
+                break
+            started = time.monotonic()
+            if self.wakeup.is_set():
+                self.wakeup.clear()
+                self.next_run = started
+            try:
+                changed = self.function()
+            except Exception:
+                # A failing tick must not end polling for good
+                registry.increment("poll_errors")
+                traceback.print_exc()
+                changed = False
+            self._adapt(changed)
+            self._advance(started)
+
+    def _advance(self, started):
+        # Fixed rate: the next tick is due one interval after the previous
+        # deadline, not after the end of a slow tick
+        interval = self.next_interval()
+        self.next_run += interval
+        now = time.monotonic()
+        if now > self.next_run:
+            self.overruns += 1
+            registry.increment("poll_overruns")
+            missed = (now - self.next_run) // interval + 1
+            self.next_run += missed * interval
+        registry.observe_timing("poll_tick", now - started)
+
+    def next_interval(self):
+        if self.transition:
+            return self.fast_interval
+        if self.hidden:
+            return max(self.interval, self.hidden_interval)
+
+        return self.interval
+
+    def _adapt(self, changed):
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def wake(self):
+        self.interval = self.min_interval
+        self.wakeup.set()
+
+    def set_hidden(self, hidden):
+        self.hidden = hidden
+        if not hidden:
+            self.wake()
+
+    def set_transition(self, transition):
+        started = transition and not self.transition
+        self.transition = transition
+        if started:
+            self.wake()
+
+    def cancel(self):
         self.finished.set()
+        self.wakeup.set()
 
 
-def _escape_ansi(line):
-    ansi_escape = re.compile(r"(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]")
-
-    return ansi_escape.sub("", line)
-
-
-def _remove_whitespace(string, num=2):
-    return re.split(r"\s{" + str(num) + ",}", string)
+COMMAND_TIMEOUT = 10
+COMMAND_TIMEOUTS = {"activate": 30, "connect": 60, "disconnect": 30}
+READ_CACHE_WINDOW = 0.5
 
 
-def _parse_all_locations():
-    output = subprocess.check_output("expressvpn list all", shell=True)
-    result = output.decode().split("\n")
-    results = [_remove_whitespace(el) for el in result]
-    output = []
-    start_key = 0
+def _call_now(function, *args):
+    function(*args)
 
-    for key, element in enumerate(results):
-        new_el = []
-        element = list(filter(None, element))
-        if len(element) > 0:
-            element[0] = element[0].split()[0]
 
-        for el in element:
-            el_break = el.split(") ", 1)[-1]
-            new_el.append(el_break)
-
-            if el_break.startswith("smart"):
-                start_key = key
-
-        if new_el:
-            output.append(new_el)
+class CommandExecutor:
+    def __init__(self, max_workers=8, dispatch=None, cache_window=READ_CACHE_WINDOW):
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="expressvpn"
+        )
+        self.dispatch = dispatch or _call_now
+        self.cache_window = cache_window
+        self.inflight = {}
+        self.results = {}
+        self.read_lock = Lock()
+
+    def run(self, *args, timeout=None):
+        timeout = timeout or COMMAND_TIMEOUTS.get(args[0], COMMAND_TIMEOUT)
+        name = f"expressvpn {args[0]}"
+        started = time.monotonic()
+        try:
+            output = subprocess.check_output(["expressvpn", *args], timeout=timeout)
+        except Exception as error:
+            registry.observe_error(name, time.monotonic() - started, error)
+            raise
+        registry.observe(name, time.monotonic() - started)
+
+        return output.decode()
+
+    def read(self, *args, timeout=None, fresh=False):
+        with self.read_lock:
+            cached = None if fresh else self.results.get(args)
+            if cached and time.monotonic() - cached[1] < self.cache_window:
+                return cached[0]
+            future = self.inflight.get(args)
+            leader = future is None
+            if leader:
+                future = self.inflight[args] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            output = self.run(*args, timeout=timeout)
+        except BaseException as error:
+            self._settle(args, future)
+            future.set_exception(error)
+            raise
+        self._settle(args, future, output)
+        future.set_result(output)
+
+        return output
+
+    def _settle(self, args, future, output=None):
+        with self.read_lock:
+            # A write invalidated this read while it was running, keep it uncached
+            if self.inflight.get(args) is not future:
+                return
+            del self.inflight[args]
+            if output is not None:
+                self.results[args] = (output, time.monotonic())
+
+    def invalidate(self):
+        with self.read_lock:
+            self.inflight.clear()
+            self.results.clear()
+
+    def submit(self, function, *args, callback=None, errback=None):
+        future = self.pool.submit(function, *args)
+        if callback or errback:
+            future.add_done_callback(partial(self._deliver, callback, errback))
+
+        return future
+
+    def run_async(self, *args, callback=None, errback=None, timeout=None):
+        command = partial(self._write, *args, timeout=timeout)
+
+        return self.submit(command, callback=callback, errback=errback)
+
+    def _write(self, *args, timeout=None):
+        self.invalidate()
+        try:
+            return self.run(*args, timeout=timeout)
+        finally:
+            self.invalidate()
+
+    def _deliver(self, callback, errback, future):
+        error = future.exception()
+        if error is None:
+            if callback:
+                self.dispatch(callback, future.result())
+        elif errback:
+            self.dispatch(errback, error)
+
+
+executor = CommandExecutor()
+
+CATALOG_TTL = 60 * 60
+CATALOG_RETRY = 60
+
+_search_token = re.compile(r"\w+")
+
+
+class LocationCatalog:
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self.locations = []
+        self.by_name = {}
+        self.by_key = {}
+        self.prefixes = {}
+        self.output = None
+        self.loaded_at = None
+        self.refreshing = False
+        self.lock = Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def load(self, output):
+        locations = parse_locations(output)
+
+        with self.lock:
+            self.output = output
+            self.locations = locations
+            self.by_name = {location.name: location for location in locations}
+            self.by_key = {location.key: location for location in locations}
+            self.prefixes = self._index(locations)
+            self.loaded_at = time.monotonic()
+
+    def refresh(self):
+        self.load(executor.read("list", "all"))
+
+    def _ensure_loaded(self):
+        loaded_at = self.loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at <= self.ttl:
+            return
+        if self.output is None:
+            # Nothing to serve yet, the caller has to wait for the first load
+            self.refresh()
+            return
+
+        # Serve the stale index, callers may be on the GTK thread
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        executor.submit(self._refresh_in_background)
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except (OSError, subprocess.SubprocessError):
+            with self.lock:
+                # Keep the stale index and retry in a minute, not on every call
+                self.loaded_at = time.monotonic() - self.ttl + CATALOG_RETRY
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def names(self):
+        self._ensure_loaded()
+        return sorted(self.by_name)
+
+    def key_for(self, name, default="smart"):
+        self._ensure_loaded()
+        location = self.by_name.get(name)
+        return location.key if location else default
+
+    def name_for(self, key, default=None):
+        self._ensure_loaded()
+        location = self.by_key.get(key)
+        return location.name if location else default
+
+    def groups(self):
+        self._ensure_loaded()
+        groups = {}
+
+        for location in self.locations:
+            if location.key == "smart":
+                continue
+            group = groups.setdefault(location.country or "Other", [])
+            if location.name not in group:
+                group.append(location.name)
+
+        return {country: sorted(names) for country, names in groups.items()}
+
+    def search(self, text):
+        self._ensure_loaded()
+        tokens = _search_token.findall(text.lower())
+        if not tokens:
+            return sorted(self.by_name)
+
+        matches = set.intersection(
+            *(self.prefixes.get(token, set()) for token in tokens)
+        )
 
-    return output[start_key:]
+        return sorted(matches)
 
+    @staticmethod
+    def _index(locations):
+        prefixes = {}
 
-def _get_locations_dict():
-    output = _parse_all_locations()
-    locations = {}
+        for location in locations:
+            text = f"{location.name} {location.country or ''} {location.key}"
+            for token in _search_token.findall(text.lower()):
+                for end in range(1, len(token) + 1):
+                    prefixes.setdefault(token[:end], set()).add(location.name)
 
-    for element in output:
-        location = (
-            element[-1].strip() if element[-1].strip() != "Y" else element[-2].strip()
-        )
-        key = element[0].strip()
-        locations[location] = key
+        return prefixes
 
-    return locations
+    def get(self, name):
+        self._ensure_loaded()
+        return self.by_name.get(name)
 
+    def __contains__(self, name):
+        self._ensure_loaded()
+        return name in self.by_name
 
-def get_settings(settings_file):
-    if not os.path.exists(settings_file):
-        open(settings_file, "w").close()
-        return None
 
-    with open(settings_file, "r") as f:
-        lines = f.readlines()
+catalog = LocationCatalog()
 
-    if len(lines) < 1 or lines[0] not in _get_locations_dict():
-        return None
 
-    return lines[0]
+def load_cache(cache_file):
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
 
-def set_settings(settings_file, location):
-    with open(settings_file, "w") as f:
-        f.write(location)
+def save_cache(cache_file, cache):
+    temp_file = f"{cache_file}.tmp"
+    try:
+        with open(temp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
 
 
+@registry.timed("get_locations_list")
 def get_locations_list():
-    output = _parse_all_locations()
-    locations = []
-
-    for element in output:
-        location = (
-            element[-1].strip() if element[-1].strip() != "Y" else element[-2].strip()
-        )
-        locations.append(location)
-
-    locations.sort()
-
-    return locations
+    return catalog.names()
 
 
+@registry.timed("get_protocol_list")
 def get_protocol_list():
-    output = subprocess.check_output("expressvpn protocol --list", shell=True)
-    result = output.decode().split("\n")
-
-    return [protocol for protocol in result if protocol]
+    return parse_protocols(executor.read("protocol", "--list"))
 
 
+@registry.timed("get_preferences_dict")
 def get_preferences_dict():
-    output = subprocess.check_output("expressvpn preferences", shell=True)
-    result = output.decode().split("\n")
-    preferences = {}
-
-    for element in result:
-        if not element:
-            continue
-        preference = _remove_whitespace(element, 1)
-        preferences[preference[0]] = preference[1]
-
-    return preferences
+    return parse_preferences(executor.read("preferences"))
 
 
+@registry.timed("set_network_lock")
 def set_network_lock(lock_type="default"):
-    subprocess.Popen(
-        [f"expressvpn preferences set network_lock {lock_type}"], shell=True
-    )
+    return executor.run_async("preferences", "set", "network_lock", lock_type)
 
 
+@registry.timed("set_protocol")
 def set_protocol(protocol_type="default"):
-    subprocess.Popen([f"expressvpn protocol {protocol_type}"], shell=True)
+    return executor.run_async("protocol", protocol_type)
+
+
+PREFERENCE_DEBOUNCE = 0.4
+PREFERENCE_SETTERS = {
+    "network_lock": set_network_lock,
+    "preferred_protocol": set_protocol,
+}
+
+
+class PreferenceWriter:
+    def __init__(self, on_done, delay=PREFERENCE_DEBOUNCE):
+        self.on_done = on_done
+        self.delay = delay
+        self.pending = {}
+        self.inflight = {}
+        self.timers = {}
+        self.lock = Lock()
+
+    def request(self, key, value):
+        with self.lock:
+            self.pending[key] = value
+            if key in self.timers:
+                self.timers[key].cancel()
+            timer = self.timers[key] = Timer(self.delay, self._flush, (key,))
+            timer.daemon = True
+            timer.start()
+
+    def values(self):
+        with self.lock:
+            return dict(self.inflight, **self.pending)
+
+    def _flush(self, key):
+        with self.lock:
+            self.timers.pop(key, None)
+            # Only one write per preference at a time, the latest value
+            # is sent once the current one has been confirmed
+            if key in self.inflight or key not in self.pending:
+                return
+            value = self.inflight[key] = self.pending.pop(key)
+
+        future = PREFERENCE_SETTERS[key](value)
+        future.add_done_callback(partial(self._confirm, key, value))
+
+    def _confirm(self, key, value, future):
+        error = future.exception()
+        try:
+            preferences = get_preferences_dict()
+        except (OSError, subprocess.SubprocessError):
+            preferences = None
+        if error is None and preferences is not None and preferences.get(key) != value:
+            error = f"{key} is still {preferences.get(key)}"
+
+        with self.lock:
+            del self.inflight[key]
+            queued = key in self.pending and key not in self.timers
+        self.on_done(key, value, preferences, str(error) if error else None)
+        if queued:
+            self._flush(key)
+
+
+@registry.timed("get_location_key")
+def get_location_key(location):
+    return catalog.key_for(location)
 
 
-def get_location_key(location):
-    data = _get_locations_dict()
-    key = data.get(location, "smart")
+DAEMON_DOWN = StatusSnapshot(False, False, False, None, "")
+
 
-    return key
+@registry.timed("get_status")
+def get_status(fresh=False):
+    try:
+        output = executor.read("status", fresh=fresh)
+    except (OSError, subprocess.CalledProcessError):
+        return DAEMON_DOWN
+
+    return parse_status(output)
 
 
+@registry.timed("get_active_location")
 def get_active_location():
-    output = subprocess.check_output("expressvpn status", shell=True)
-    result = _escape_ansi(output.decode())
-    result = result.split("\n")
-    location = None
+    return get_status().location
 
-    for res in result:
-        if not res.startswith("Connected to "):
-            continue
-        location = res.replace("Connected to ", "")
 
-    return location
+@lru_cache(maxsize=None)
+@registry.timed("get_version")
+def get_version():
+    try:
+        output = executor.read("-v")
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    return parse_version(output)
 
 
+@registry.timed("check_expressvpn")
 def check_expressvpn():
-    output = subprocess.check_output("expressvpn -v", shell=True)
-    result = _escape_ansi(output.decode())
+    return get_version() is not None
 
-    if "expressvpn version" in result:
-        return True
 
-    return False
+@registry.timed("check_daemon")
+def check_daemon():
+    return get_status().daemon_running
 
 
-def check_daemon():
-    try:
-        _ = subprocess.check_output("expressvpn status", shell=True)
-    except subprocess.CalledProcessError:
-        return False
+@registry.timed("check_connection")
+def check_connection(status=None):
+    if reachability.passive and status is None:
+        status = get_status()
 
-    return True
+    return reachability.check(status)
 
 
-def check_connection():
-    conn = httplib.HTTPSConnection("google.com", timeout=5)
-    try:
-        conn.request("GET", "/")
-        return True
-    except Exception:
-        return False
-    finally:
-        conn.close()
+def check_errors(update=False, status=None):
+    # Passive checks only look at the status, so polls can afford them too
+    if (not update or reachability.passive) and not check_connection(status):
+        return "internet_connection_error"
+    if not check_expressvpn():
+        return "expressvpn_error"
+    status = status or get_status()
+    if not status.daemon_running:
+        return "expressvpn_daemon_error"
+    if not status.activated:
+        return "expressvpn_activation_error"
 
 
+@registry.timed("activate_command")
 def activate_command(key):
-    child = pexpect.spawn("expressvpn activate")
+    child = pexpect.spawn(
+        "expressvpn", ["activate"], timeout=COMMAND_TIMEOUTS["activate"]
+    )
     child.expect("Enter activation code: ")
     child.sendline(key)
     child.read()
+    executor.invalidate()
 
 
+@registry.timed("connect_command")
 def connect_command(key):
-    subprocess.Popen([f"expressvpn connect {key}"], shell=True)
+    return executor.run_async("connect", key)
 
 
+@registry.timed("disconnect_command")
 def disconnect_command():
-    subprocess.Popen(["expressvpn disconnect"], shell=True)
+    return executor.run_async("disconnect")
 
 
+@registry.timed("is_activated")
 def is_activated():
-    if not check_daemon():
-        return False
-
-    output = subprocess.check_output("expressvpn status", shell=True)
-    result = _escape_ansi(output.decode())
-
-    if "Not Activated" in result:
-        return False
+    status = get_status()
 
-    return True
+    return status.daemon_running and status.activated
 
 
+@registry.timed("is_connected")
 def is_connected():
-    if not check_daemon():
-        return False
+    return get_status().connected
+
+
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+DISCONNECTING = "disconnecting"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+
+CONNECT_TIMEOUT = 60
+DISCONNECT_TIMEOUT = 30
+
+
+class ConnectionStateMachine:
+    def __init__(
+        self, connect_timeout=CONNECT_TIMEOUT, disconnect_timeout=DISCONNECT_TIMEOUT
+    ):
+        self.connect_timeout = connect_timeout
+        self.disconnect_timeout = disconnect_timeout
+        self.state = DISCONNECTED
+        self.location = None
+        self.started_at = None
+        self.deadline = None
+        self.listeners = []
+        self.lock = Lock()
+
+    @property
+    def busy(self):
+        return self.state in (CONNECTING, DISCONNECTING)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0
+
+        return time.monotonic() - self.started_at
+
+    @property
+    def progress(self):
+        if not self.busy:
+            return 1
+        timeout = self.deadline - self.started_at
+
+        return min(self.elapsed / timeout, 1)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def connect(self, location, protocol=None):
+        with self.lock:
+            if self.busy:
+                return False
+            self._set(CONNECTING, location, self.connect_timeout)
+        self._notify()
+        if protocol:
+            # The connect follows the protocol switch whether it worked or not
+            future = set_protocol(protocol)
+            future.add_done_callback(partial(self._start_connect, location))
+        else:
+            self._start_connect(location)
+
+        return True
 
-    output = subprocess.check_output("expressvpn status", shell=True)
-    result = _escape_ansi(output.decode())
+    def _start_connect(self, location, _=None):
+        with self.lock:
+            if self.state != CONNECTING or self.location != location:
+                return
+        future = connect_command(catalog.key_for(location))
+        future.add_done_callback(partial(self._command_done, CONNECTING))
+
+    def disconnect(self):
+        with self.lock:
+            if self.state == DISCONNECTING:
+                return False
+            self._set(DISCONNECTING, self.location, self.disconnect_timeout)
+        self._notify()
+        future = disconnect_command()
+        future.add_done_callback(partial(self._command_done, DISCONNECTING))
 
-    if "Connected to" in result:
         return True
 
-    return False
+    def cancel(self):
+        if self.state != CONNECTING:
+            return False
+
+        return self.disconnect()
+
+    def update(self, status):
+        with self.lock:
+            state = self.state
+            timed_out = self.deadline is not None and time.monotonic() > self.deadline
+
+            if state == CONNECTING:
+                if status.connected:
+                    self._set(CONNECTED, status.location)
+                elif timed_out:
+                    self._time_out()
+            elif state == DISCONNECTING:
+                if not status.connected:
+                    self._set(DISCONNECTED, self.location)
+                elif timed_out:
+                    self._time_out()
+            elif status.connected:
+                if state != CONNECTED or status.location != self.location:
+                    self._set(CONNECTED, status.location)
+            elif state == CONNECTED:
+                self._set(DISCONNECTED, self.location)
+
+            changed = state != self.state or self.busy
+        if changed:
+            self._notify()
+
+    def _set(self, state, location, timeout=None):
+        now = time.monotonic()
+        self.state = state
+        self.location = location
+        self.started_at = now if timeout else None
+        self.deadline = now + timeout if timeout else None
+
+    def _time_out(self):
+        if self.state == CONNECTING:
+            disconnect_command()
+        self._set(TIMED_OUT, self.location)
+
+    def _command_done(self, state, future):
+        error = future.exception()
+        if error is None:
+            return
+        with self.lock:
+            if self.state != state:
+                return
+            if isinstance(error, subprocess.TimeoutExpired):
+                self._time_out()
+            else:
+                self._set(FAILED, self.location)
+        self._notify()
+
+    def _notify(self):
+        for listener in self.listeners:
+            executor.dispatch(listener, self)